@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""
+Microbenchmark of directory listing, counts stat, open and pwd calls per listed entry and measures time per entry.
+
+Old path is FileInfo as it was before it was built from a single stat result (LegacyFileInfo below is its copy,
+only current_user is replaced by explicit system_user), old scan_directory resolved parents of every entry.
+New path is FileInfo.from_dir_entry as used by scan_directory now.
+
+Usage: python benchmarks/file_info_listing.py [--entries 2000] [--depth 8] [--repeat 5]
+"""
+import os
+import io
+import pwd
+import sys
+import stat
+import time
+import shutil
+import argparse
+import builtins
+import datetime
+import tempfile
+import functools
+import mimetypes
+from pathlib import Path
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tux_control.models.FileInfo import FileInfo  # noqa: E402
+
+calls = Counter()
+
+
+class LegacyFileInfo:
+    is_writable = False
+    is_readable = False
+    updated = None
+    created = None
+    size = 0
+    _mime_type = None
+
+    def __init__(self, path: Path, resolve_parents: bool = True, stat_info: os.stat_result = None, system_user: str = None):
+        self.path = path
+
+        self.name = self.path.name
+        self.suffix = self.path.suffix.strip('.')
+        self.parts = self.path.parts
+        if stat_info:
+            self.is_dir = stat.S_ISDIR(stat_info.st_mode)
+            self.is_file = stat.S_ISREG(stat_info.st_mode)
+        else:
+            self.is_dir = self.path.is_dir()
+            self.is_file = self.path.is_file()
+        self.stem = self.path.stem
+        self.absolute = str(path.absolute())
+
+        self.owner = path.owner() if self.is_file or self.is_dir else None
+
+        self.parent = LegacyFileInfo(self.path.parent, False, system_user=system_user) if resolve_parents else None
+        self.parents = [LegacyFileInfo(p, False, system_user=system_user) for p in self.path.parents] if resolve_parents else None
+
+        if not stat_info:
+            stat_info = path.stat() if self.is_file or self.is_dir else None
+
+        if stat_info:
+            self.size = stat_info.st_size
+
+            self.updated = datetime.datetime.fromtimestamp(stat_info.st_mtime)
+            self.created = datetime.datetime.fromtimestamp(stat_info.st_ctime)
+
+            self.is_writable = (bool(stat_info.st_mode & stat.S_IWUSR) and self.owner == system_user) or bool(stat_info.st_mode & stat.S_IWOTH)
+            self.is_readable = (bool(stat_info.st_mode & stat.S_IRUSR) and self.owner == system_user) or bool(stat_info.st_mode & stat.S_IROTH)
+
+    @property
+    def mime_type(self) -> str:
+        if not self.is_file:
+            return None
+
+        if self._mime_type is None:
+            guessed_type, _ = mimetypes.guess_type(self.name, strict=False)
+            self._mime_type = guessed_type or 'application/octet-stream'
+        return self._mime_type
+
+    @staticmethod
+    def from_dir_entry(entry: os.DirEntry, resolve_parents: bool = True, system_user: str = None) -> 'LegacyFileInfo':
+        try:
+            stat_info = entry.stat()
+        except OSError:
+            stat_info = None
+        return LegacyFileInfo(Path(entry.path), resolve_parents, stat_info, system_user)
+
+    def is_allowed_file(self) -> bool:
+        if self.name.startswith('.'):
+            return False
+
+        if not self.path.is_file() and not self.path.is_dir():
+            return False
+
+        if not self.is_writable:
+            return False
+
+        return True
+
+    def to_dict(self):
+        return {
+            'parts': self.parts,
+            'parent': self.parent.to_dict() if self.parent else None,
+            'parents': [parent.to_dict() for parent in self.parents] if self.parents else None,
+            'name': self.name,
+            'absolute': self.absolute,
+            'suffix': self.suffix,
+            'stem': self.stem,
+            'is_dir': self.is_dir,
+            'is_file': self.is_file,
+            'is_writable': self.is_writable,
+            'is_readable': self.is_readable,
+            'mime_type': self.mime_type,
+            'owner': self.owner,
+            'size': self.size,
+            'created': self.created.isoformat() if self.created else None,
+            'updated': self.updated.isoformat() if self.updated else None,
+        }
+
+
+class CountedDirEntry:
+    """
+    DirEntry.stat is implemented in C and cannot be patched, entries are wrapped to count it
+    """
+    __slots__ = ('entry',)
+
+    def __init__(self, entry: os.DirEntry):
+        self.entry = entry
+
+    @property
+    def name(self) -> str:
+        return self.entry.name
+
+    @property
+    def path(self) -> str:
+        return self.entry.path
+
+    def stat(self) -> os.stat_result:
+        calls['stat'] += 1
+        return self.entry.stat()
+
+
+def counted(name: str, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        calls[name] += 1
+        return function(*args, **kwargs)
+    return wrapper
+
+
+def install_counters():
+    os.stat = counted('stat', os.stat)
+    os.lstat = counted('stat', os.lstat)
+    os.open = counted('open', os.open)
+    io.open = builtins.open = counted('open', builtins.open)
+    pwd.getpwuid = counted('getpwuid', pwd.getpwuid)
+
+
+def list_legacy(directory: str, system_user: str) -> list:
+    with os.scandir(directory) as entries:
+        file_infos = [LegacyFileInfo.from_dir_entry(CountedDirEntry(entry), True, system_user) for entry in entries]
+    return [file_info.to_dict() for file_info in file_infos if file_info.is_allowed_file()]
+
+
+def list_current(directory: str, system_user: str) -> list:
+    with os.scandir(directory) as entries:
+        file_infos = [FileInfo.from_dir_entry(CountedDirEntry(entry), False, system_user) for entry in entries]
+    return [file_info.to_dict(include_parents=False) for file_info in file_infos if file_info.is_allowed_file()]
+
+
+def list_current_with_parents(directory: str, system_user: str) -> list:
+    with os.scandir(directory) as entries:
+        file_infos = [FileInfo.from_dir_entry(CountedDirEntry(entry), True, system_user) for entry in entries]
+    return [file_info.to_dict() for file_info in file_infos if file_info.is_allowed_file()]
+
+
+def make_directory(root: str, entries: int, depth: int) -> str:
+    directory = os.path.join(root, *['level{}'.format(level) for level in range(depth)])
+    os.makedirs(directory)
+    for index in range(entries):
+        if index % 10 == 0:
+            os.mkdir(os.path.join(directory, 'directory{}'.format(index)))
+        else:
+            with open(os.path.join(directory, 'file{}.txt'.format(index)), 'w') as listed_file:
+                listed_file.write('x' * index)
+    return directory
+
+
+def measure(function, directory: str, system_user: str, entries: int, repeat: int) -> tuple:
+    calls.clear()
+    listed = function(directory, system_user)
+    counts = {name: count / entries for name, count in calls.items()}
+
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(directory, system_user)
+        durations.append(time.perf_counter() - started)
+    return len(listed), counts, min(durations) / entries * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares stat calls per listed entry of old and current FileInfo')
+    parser.add_argument('--entries', type=int, default=2000, help='entries in listed directory')
+    parser.add_argument('--depth', type=int, default=8, help='depth of listed directory below temporary directory')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs, the fastest one is reported')
+    args = parser.parse_args()
+
+    system_user = pwd.getpwuid(os.getuid()).pw_name
+    root = tempfile.mkdtemp()
+    try:
+        directory = make_directory(root, args.entries, args.depth)
+        install_counters()
+        print('{} entries, depth {}'.format(args.entries, len(Path(directory).parts) - 1))
+        print('{:<28} {:>7} {:>7} {:>7} {:>9} {:>10}'.format('path', 'listed', 'stat', 'open', 'getpwuid', 'us/entry'))
+        for name, function in (
+                ('old, parents resolved', list_legacy),
+                ('current, parents resolved', list_current_with_parents),
+                ('current, scan_directory', list_current),
+        ):
+            listed, counts, duration = measure(function, directory, system_user, args.entries, args.repeat)
+            print('{:<28} {:>7} {:>7.2f} {:>7.2f} {:>9.2f} {:>10.1f}'.format(
+                name, listed, counts.get('stat', 0), counts.get('open', 0), counts.get('getpwuid', 0), duration
+            ))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
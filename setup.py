@@ -65,6 +65,7 @@ setup(
         'flask-sqlalchemy>=2.5.1,~=3.0.3',
         'flask-jwt-extended~=4.4.4',  # Remove old version from my repository if this works
         'file-thumbnailer[pdf]==0.0.9',
+        'Pillow',
         'eventlet',
         'setuptools',
         'flask-cors',
@@ -0,0 +1,118 @@
+import io
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+from tux_control.tools.ChunkedUpload import ChunkedUpload
+
+MIB = 1024 * 1024
+
+
+class TestChunkedUpload(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.uploads_directory = os.path.join(self.directory, 'uploads')
+        self.parent_directory = os.path.join(self.directory, 'parent')
+        os.mkdir(self.uploads_directory)
+        os.mkdir(self.parent_directory)
+        self.content = os.urandom(MIB * 5 // 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create(self, size: int = None, chunks: int = None, chunk_size: int = None) -> ChunkedUpload:
+        return ChunkedUpload.create(self.uploads_directory, {'absolute': self.parent_directory}, 'user', size, chunks, chunk_size)
+
+    def load(self, upload: ChunkedUpload) -> ChunkedUpload:
+        # Every chunk request loads the upload again
+        return ChunkedUpload.load(self.uploads_directory, upload.id)
+
+    def send(self, upload: ChunkedUpload, index: int, chunk_size: int = MIB, length: int = None, layout: bool = False) -> int:
+        offset = index * chunk_size
+        chunk = self.content[offset:offset + (chunk_size if length is None else length)]
+        upload = self.load(upload)
+        if layout:
+            upload.set_layout(len(self.content), 3)
+        return upload.write_chunk(index, offset, io.BytesIO(chunk), hashlib.sha256(chunk).hexdigest() if length is None else None)
+
+    def finish(self, upload: ChunkedUpload) -> bytes:
+        self.assertTrue(upload.is_complete())
+        self.assertTrue(upload.claim_finalize())
+        with open(upload.finalize('file.bin'), 'rb') as uploaded_file:
+            return uploaded_file.read()
+
+    def test_legacy_client_with_fixed_chunk_size(self):
+        # 1 MiB chunks of 2.5 MiB file, chunk size is not sent
+        for order in ([0, 1, 2], [2, 1, 0], [0, 2, 1], [1, 0, 2]):
+            upload = self.create(len(self.content), 3)
+            for index in order:
+                self.send(upload, index)
+
+            self.assertEqual(self.content, self.finish(upload), order)
+            upload.remove()
+
+    def test_chunk_size_sent_by_client(self):
+        upload = self.create(len(self.content), 3, MIB)
+        for index in (2, 0, 1):
+            self.send(upload, index)
+
+        self.assertEqual(self.content, self.finish(upload))
+
+    def test_truncated_first_chunk_is_sent_again(self):
+        upload = self.create(len(self.content), 3)
+        # Still plausible chunk size, it is guessed from it
+        self.send(upload, 0, length=MIB - 1000)
+        self.assertEqual([0], self.load(upload).get_received())
+
+        # Offset of other chunk tells the real chunk size
+        self.send(upload, 1)
+        self.assertEqual([1], self.load(upload).get_received())
+
+        self.send(upload, 2)
+        self.send(upload, 0)
+        self.assertEqual(self.content, self.finish(self.load(upload)))
+
+    def test_short_chunk_is_not_marked(self):
+        upload = self.create(len(self.content), 3)
+        self.send(upload, 1)
+        with self.assertRaises(ValueError):
+            self.send(upload, 2, length=1000)
+        with self.assertRaises(ValueError):
+            self.send(upload, 0, length=1000)
+
+        self.assertEqual([1], self.load(upload).get_received())
+
+    def test_inconsistent_offsets_are_rejected(self):
+        upload = self.create(len(self.content), 3)
+        self.send(upload, 1)
+        with self.assertRaises(ValueError):
+            self.send(upload, 2, chunk_size=MIB + 1)
+
+    def test_concurrent_first_chunks_without_layout(self):
+        for _ in range(20):
+            upload = self.create()
+            barrier = threading.Barrier(3)
+            errors = []
+
+            def send(index: int):
+                barrier.wait()
+                try:
+                    self.send(upload, index, layout=True)
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=send, args=(index,)) for index in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual([], errors)
+            self.assertEqual(self.content, self.finish(self.load(upload)))
+            upload.remove()
+
+
+if __name__ == '__main__':
+    unittest.main()
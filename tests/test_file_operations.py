@@ -0,0 +1,67 @@
+import os
+import pwd
+import shutil
+import tempfile
+import unittest
+from tux_control.tools import file_operations
+
+
+@unittest.skipUnless(os.geteuid() == 0, 'Copies are checked against permissions of other user, only root can do that')
+class TestCopy(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.chmod(self.directory, 0o755)
+        self.source = os.path.join(self.directory, 'source')
+        self.destination = os.path.join(self.directory, 'destination')
+        os.mkdir(self.source, 0o755)
+        self.nobody = pwd.getpwnam('nobody')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name: str, mode: int = 0o644) -> str:
+        path = os.path.join(self.source, name)
+        with open(path, 'w') as source_file:
+            source_file.write(name)
+        os.chmod(path, mode)
+        return path
+
+    def copy(self) -> list:
+        return file_operations.copy(self.source, self.destination, self.nobody.pw_uid, self.nobody.pw_gid)
+
+    def test_copy_tree(self):
+        self.write('readable')
+        os.mkdir(os.path.join(self.source, 'directory'), 0o755)
+        self.write(os.path.join('directory', 'nested'))
+        os.symlink('/etc/shadow', os.path.join(self.source, 'link'))
+
+        self.assertEqual([], self.copy())
+        with open(os.path.join(self.destination, 'directory', 'nested')) as copied_file:
+            self.assertEqual(os.path.join('directory', 'nested'), copied_file.read())
+        self.assertEqual('/etc/shadow', os.readlink(os.path.join(self.destination, 'link')))
+        self.assertEqual(self.nobody.pw_uid, os.lstat(os.path.join(self.destination, 'link')).st_uid)
+        self.assertEqual(self.nobody.pw_uid, os.stat(os.path.join(self.destination, 'directory', 'nested')).st_uid)
+
+    def test_unreadable_entries_are_skipped(self):
+        secret = self.write('secret', 0o600)
+        closed = os.path.join(self.source, 'closed')
+        os.mkdir(closed, 0o700)
+
+        self.assertEqual(sorted([secret, closed]), sorted(self.copy()))
+        self.assertEqual([], os.listdir(self.destination))
+
+    def test_fifo_is_skipped_without_blocking(self):
+        fifo = os.path.join(self.source, 'fifo')
+        os.mkfifo(fifo, 0o644)
+
+        self.assertEqual([fifo], self.copy())
+
+    def test_symlink_swapped_in_for_file_is_not_followed(self):
+        self.assertFalse(file_operations.copy_file('/etc/shadow', os.path.join(self.directory, 'shadow'), uid=self.nobody.pw_uid, gid=self.nobody.pw_gid))
+        os.symlink('/etc/shadow', os.path.join(self.source, 'link'))
+        self.assertFalse(file_operations.copy_file(os.path.join(self.source, 'link'), os.path.join(self.directory, 'copy')))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'copy')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+import flask
+from tux_control.tools.ThumbnailCache import ThumbnailCache
+from tux_control.tools.thumbnail_storage.PackThumbnailStorage import PackThumbnailStorage
+
+
+def get_key(name: str) -> str:
+    return hashlib.sha1(name.encode('UTF-8')).hexdigest()
+
+
+def get_thumbnail(name: str, size: int = 1000) -> bytes:
+    return (name.encode('UTF-8') * size)[:size]
+
+
+class TestPackThumbnailStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def storage(self) -> PackThumbnailStorage:
+        # Every instance stands for other process sharing the pack
+        return PackThumbnailStorage(self.directory, 'jpg')
+
+    def write(self, storage: PackThumbnailStorage, *names: str) -> None:
+        for name in names:
+            self.assertTrue(storage.write(get_key(name), {'x100': get_thumbnail(name)}))
+
+    def read(self, storage: PackThumbnailStorage, name: str) -> bytes:
+        return storage.read(get_key(name), 'x100')
+
+    def stored(self, storage: PackThumbnailStorage) -> list:
+        # Least recently used first
+        return [key for key, _, _, _ in sorted(storage.load(), key=lambda item: item[3])]
+
+    def test_eviction_by_access_recency(self):
+        writer = self.storage()
+        writer.access_interval = 0
+        self.write(writer, 'a', 'b', 'c')
+        self.assertEqual(get_thumbnail('a'), self.read(writer, 'a'))
+
+        removed, _ = self.storage().collect(2000)
+
+        self.assertEqual(1, removed)
+        self.assertEqual([get_key('c'), get_key('a')], self.stored(self.storage()))
+        self.assertIsNone(self.read(writer, 'b'))
+
+    def test_accesses_are_appended_with_next_write(self):
+        writer = self.storage()
+        self.write(writer, 'a', 'b')
+        self.read(writer, 'a')
+        self.write(writer, 'c')
+
+        self.assertEqual([get_key('b'), get_key('a'), get_key('c')], self.stored(self.storage()))
+
+    def test_tombstone_of_other_process(self):
+        reader = self.storage()
+        remover = self.storage()
+        self.write(remover, 'a', 'b')
+        self.assertEqual(get_thumbnail('a'), self.read(reader, 'a'))
+
+        remover.remove(get_key('a'), ['x100'])
+
+        self.assertIsNone(self.read(reader, 'a'))
+        self.assertEqual(get_thumbnail('b'), self.read(reader, 'b'))
+
+    def test_compaction_keeps_order_and_live_records(self):
+        storage = self.storage()
+        names = ['file{}'.format(index) for index in range(20)]
+        self.write(storage, *names)
+        for name in names[::2]:
+            storage.remove(get_key(name), ['x100'])
+        storage.access_interval = 0
+        self.read(storage, names[1])
+        size = os.path.getsize(storage.path)
+
+        removed, reclaimed = storage.collect(10 ** 6)
+
+        self.assertEqual(0, removed)
+        self.assertGreater(reclaimed, 0)
+        self.assertEqual(size - reclaimed, os.path.getsize(storage.path))
+        live = names[3::2] + [names[1]]
+        self.assertEqual([get_key(name) for name in live], self.stored(self.storage()))
+        for name in live:
+            self.assertEqual(get_thumbnail(name), self.read(self.storage(), name))
+
+    def test_records_appended_during_compaction_are_kept(self):
+        storage = self.storage()
+        other = self.storage()
+        self.write(storage, 'a', 'b', 'c', 'd')
+        for name in ('a', 'b', 'c'):
+            storage.remove(get_key(name), ['x100'])
+        self.write(other, 'e')
+        self.read(other, 'e')
+
+        lock = storage._lock
+
+        def lock_after_other_write(*args, **kwargs):
+            # Copying of live records runs without lock, other process appends meanwhile
+            self.write(other, 'late')
+            other.remove(get_key('d'), ['x100'])
+            return lock(*args, **kwargs)
+
+        storage._lock = lock_after_other_write
+        self.assertGreater(storage.collect(10 ** 6)[1], 0)
+
+        self.assertEqual([get_key('e'), get_key('late')], self.stored(self.storage()))
+        # Other process follows the new pack
+        self.assertEqual(get_thumbnail('late'), self.read(other, 'late'))
+        self.assertEqual(get_thumbnail('e'), self.read(other, 'e'))
+        self.assertIsNone(self.read(other, 'd'))
+
+    def test_torn_record_is_dropped(self):
+        storage = self.storage()
+        self.write(storage, 'a')
+        with open(storage.path, 'ab') as pack_file:
+            # Crashed writer left part of header and data
+            pack_file.write(b'\x01\x04' + b'x' * 30)
+
+        reader = self.storage()
+        self.assertEqual(get_thumbnail('a'), self.read(reader, 'a'))
+        self.assertEqual([get_key('a')], self.stored(reader))
+
+        self.write(self.storage(), 'b')
+        self.assertEqual([get_key('a'), get_key('b')], self.stored(self.storage()))
+        self.assertEqual(get_thumbnail('b'), self.read(self.storage(), 'b'))
+
+    def test_damaged_thumbnail_is_not_returned(self):
+        storage = self.storage()
+        self.write(storage, 'a')
+        with open(storage.path, 'r+b') as pack_file:
+            pack_file.seek(-1, os.SEEK_END)
+            pack_file.write(b'!')
+
+        self.assertIsNone(self.read(self.storage(), 'a'))
+
+
+class TestThumbnailCacheEviction(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def cache(self) -> ThumbnailCache:
+        app = flask.Flask(__name__)
+        app.config.update({
+            'DATA_STORAGE': self.directory,
+            'THUMBNAIL_STORAGE_BUDGET': 2500,
+        })
+        return ThumbnailCache(app)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        thumbnail_cache = self.cache()
+        thumbnail_cache.put(get_key('a'), {'x100': get_thumbnail('a')})
+        thumbnail_cache.put(get_key('b'), {'x100': get_thumbnail('b')})
+        self.assertEqual(get_thumbnail('a'), thumbnail_cache.get(get_key('a'), 'x100'))
+
+        thumbnail_cache.put(get_key('c'), {'x100': get_thumbnail('c')})
+
+        self.assertIsNone(thumbnail_cache.get(get_key('b'), 'x100'))
+        self.assertEqual(2000, thumbnail_cache.get_stats()['size'])
+        # Eviction is stored, restarted process does not see evicted entry
+        restarted_cache = self.cache()
+        self.assertFalse(restarted_cache.contains(get_key('b'), 'x100'))
+        self.assertTrue(restarted_cache.contains(get_key('a'), 'x100'))
+        self.assertTrue(restarted_cache.contains(get_key('c'), 'x100'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import eventlet
+eventlet.monkey_patch()
+
+import io
+import os
+import time
+import shutil
+import tempfile
+import faulthandler
+import unittest
+from unittest import mock
+import flask
+from PIL import Image
+from tux_control.tools.ThumbnailCache import ThumbnailCache
+from tux_control.tools.ThumbnailGenerator import ThumbnailGenerator, render_thumbnails
+
+
+class TestThumbnailGenerator(unittest.TestCase):
+    def setUp(self):
+        # Frozen hub would hang the test forever, watchdog is not a green thread
+        faulthandler.dump_traceback_later(120, exit=True)
+        self.directory = tempfile.mkdtemp()
+        app = flask.Flask(__name__)
+        app.config.update({
+            'DATA_STORAGE': os.path.join(self.directory, 'data'),
+            'THUMBNAIL_WORKERS': 2,
+            'THUMBNAIL_SIZES': ['x100', '300x300'],
+        })
+        self.thumbnail_cache = ThumbnailCache(app)
+        self.thumbnail_generator = ThumbnailGenerator(app, self.thumbnail_cache)
+
+    def tearDown(self):
+        faulthandler.cancel_dump_traceback_later()
+        shutil.rmtree(self.directory)
+
+    def make_image(self, name: str, size: tuple, image_format: str = 'PNG') -> str:
+        path = os.path.join(self.directory, name)
+        Image.new('RGB', size, (len(name) * 10 % 256, 100, 200)).save(path, format=image_format)
+        return path
+
+    def generate(self, path: str, dimensions: str = 'x100') -> bytes:
+        return self.thumbnail_generator.generate(ThumbnailCache.get_key(os.stat(path)), path, dimensions)
+
+    def test_concurrent_small_images(self):
+        paths = [self.make_image('{}.png'.format(index), (200 + index, 150)) for index in range(200)]
+        ticks = []
+
+        def tick():
+            for _ in range(50):
+                ticks.append(time.monotonic())
+                eventlet.sleep(0.01)
+
+        ticker = eventlet.spawn(tick)
+        thumbnails = list(eventlet.GreenPool(50).imap(self.generate, paths))
+        ticker.wait()
+
+        for path, thumbnail in zip(paths, thumbnails):
+            self.assertIsNotNone(thumbnail, path)
+            self.assertLessEqual(Image.open(io.BytesIO(thumbnail)).height, 100)
+        # Hub kept running all the time
+        self.assertEqual(50, len(ticks))
+        self.assertLess(max(later - earlier for earlier, later in zip(ticks, ticks[1:])), 1)
+
+    def test_hub_is_not_blocked_while_rendering(self):
+        path = self.make_image('large.jpg', (6000, 4000), 'JPEG')
+        ticks = []
+        rendering = [True]
+
+        def tick():
+            while rendering[0]:
+                ticks.append(time.monotonic())
+                eventlet.sleep(0.01)
+
+        ticker = eventlet.spawn(tick)
+        started = time.monotonic()
+        thumbnail = self.generate(path, '300x300')
+        duration = time.monotonic() - started
+        rendering[0] = False
+        ticker.wait()
+
+        self.assertEqual((300, 200), Image.open(io.BytesIO(thumbnail)).size)
+        # Ticker ran while decoder was busy in its thread
+        self.assertGreater(len(ticks), duration / 0.01 / 4)
+
+    def test_concurrent_requests_share_one_job(self):
+        path = self.make_image('shared.png', (800, 600))
+        with mock.patch('tux_control.tools.ThumbnailGenerator.render_thumbnails', wraps=render_thumbnails) as render:
+            thumbnails = list(eventlet.GreenPool().imap(lambda _: self.generate(path), range(5)))
+
+        self.assertEqual(1, render.call_count)
+        self.assertEqual(1, len(set(thumbnails)))
+        self.assertTrue(self.thumbnail_cache.contains(ThumbnailCache.get_key(os.stat(path)), '300x300'))
+
+    def test_timed_out_job_is_stored_when_it_finishes(self):
+        path = self.make_image('slow.png', (800, 600))
+        key = ThumbnailCache.get_key(os.stat(path))
+
+        def slow_render(*args, **kwargs):
+            time.sleep(1)
+            return render_thumbnails(*args, **kwargs)
+
+        self.thumbnail_generator.timeout = 0.1
+        with mock.patch('tux_control.tools.ThumbnailGenerator.render_thumbnails', side_effect=slow_render):
+            self.assertIsNone(self.generate(path))
+            self.assertEqual(1, len(self.thumbnail_generator._in_flight))
+            # Nobody asks for the thumbnail again
+            while self.thumbnail_generator._in_flight:
+                eventlet.sleep(0.05)
+
+        self.assertTrue(self.thumbnail_cache.contains(key, 'x100'))
+        self.assertTrue(self.thumbnail_cache.contains(key, '300x300'))
+
+    def test_unsupported_file(self):
+        path = os.path.join(self.directory, 'text.png')
+        with open(path, 'w') as text_file:
+            text_file.write('not an image')
+
+        self.assertIsNone(self.generate(path))
+        self.assertEqual({}, self.thumbnail_generator._in_flight)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import pwd
+import shutil
+import tempfile
+import unittest
+from tux_control.tools import trash
+from tux_control.tools.pam import SystemUser
+
+
+class TestTrash(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.home = os.path.join(self.directory, 'home')
+        self.victim = os.path.join(self.directory, 'victim')
+        os.mkdir(self.home)
+        os.mkdir(self.victim)
+        with open(os.path.join(self.victim, 'secret'), 'w') as secret_file:
+            secret_file.write('secret')
+
+        password_database = pwd.getpwuid(os.getuid())
+        self.system_user = SystemUser(pwd.struct_passwd((
+            password_database.pw_name, 'x', password_database.pw_uid, password_database.pw_gid, '', self.home, '/bin/sh'
+        )))
+        self.trash_directory = os.path.join(self.home, '.local', 'share', 'Trash')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_tree(self, name: str) -> str:
+        path = os.path.join(self.home, name)
+        os.makedirs(os.path.join(path, 'a', 'b'))
+        for file_name in ('one', os.path.join('a', 'two'), os.path.join('a', 'b', 'three')):
+            with open(os.path.join(path, file_name), 'w') as tree_file:
+                tree_file.write(file_name)
+        return path
+
+    def test_move_purge(self):
+        trash_item = trash.move_to_trash(self.make_tree('tree'), self.system_user)
+
+        self.assertEqual(self.trash_directory, trash_item['trash_directory'])
+        self.assertEqual(['tree'], os.listdir(os.path.join(self.trash_directory, 'files')))
+        self.assertEqual(6, trash.purge_trash_item(self.trash_directory, 'tree', self.system_user, batch_size=2, pause=0))
+        self.assertEqual([], os.listdir(os.path.join(self.trash_directory, 'files')))
+        self.assertEqual([], os.listdir(os.path.join(self.trash_directory, 'info')))
+
+    def test_purge_does_not_follow_symlinked_files_directory(self):
+        trash.move_to_trash(self.make_tree('secret'), self.system_user)
+        files_directory = os.path.join(self.trash_directory, 'files')
+        os.rename(files_directory, files_directory + '.old')
+        os.symlink(self.victim, files_directory)
+
+        with self.assertRaises(OSError):
+            trash.purge_trash_item(self.trash_directory, 'secret', self.system_user, pause=0)
+
+        self.assertTrue(os.path.isfile(os.path.join(self.victim, 'secret')))
+
+    def test_purge_does_not_follow_symlinks_in_item(self):
+        path = self.make_tree('tree')
+        os.symlink(self.victim, os.path.join(path, 'a', 'link'))
+        trash.move_to_trash(path, self.system_user)
+
+        trash.purge_trash_item(self.trash_directory, 'tree', self.system_user, pause=0)
+
+        self.assertTrue(os.path.isfile(os.path.join(self.victim, 'secret')))
+        self.assertEqual([], os.listdir(os.path.join(self.trash_directory, 'files')))
+
+    def test_move_does_not_follow_symlinked_trash(self):
+        os.makedirs(os.path.join(self.home, '.local', 'share'))
+        os.symlink(self.victim, self.trash_directory)
+        path = self.make_tree('tree')
+
+        with self.assertRaises(OSError):
+            trash.move_to_trash(path, self.system_user)
+
+        self.assertTrue(os.path.isdir(path))
+        self.assertEqual(['secret'], os.listdir(self.victim))
+
+    def test_restore_ignores_symlinked_info_file(self):
+        trash.move_to_trash(self.make_tree('tree'), self.system_user)
+        info_path = os.path.join(self.trash_directory, 'info', 'tree.trashinfo')
+        os.unlink(info_path)
+        os.symlink(os.path.join(self.victim, 'secret'), info_path)
+
+        with self.assertRaises(FileNotFoundError):
+            trash.restore_from_trash(self.trash_directory, 'tree', self.system_user)
+
+    def test_invalid_name(self):
+        with self.assertRaises(ValueError):
+            trash.purge_trash_item(self.trash_directory, '..', self.system_user)
+
+
+if __name__ == '__main__':
+    unittest.main()
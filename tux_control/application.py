@@ -12,7 +12,7 @@ from yaml import load, SafeLoader
 from tux_control.tools.IDictify import IDictify
 
 import tux_control as app_root
-from tux_control.extensions import socketio, babel, db, migrate, celery, jwt, cors, plugin_manager
+from tux_control.extensions import socketio, babel, db, migrate, celery, jwt, cors, plugin_manager, directory_listing_cache, directory_watcher, directory_size_cache, thumbnail_cache, thumbnail_generator
 
 APP_ROOT_FOLDER = os.path.abspath(os.path.dirname(app_root.__file__))
 TEMPLATE_FOLDER = os.path.join(APP_ROOT_FOLDER, 'templates')
@@ -154,6 +154,11 @@ def create_app(config_obj, no_sql=False):
     cors.init_app(app)
     jwt.init_app(app)
     plugin_manager.init_app(app, app_root_folder=APP_ROOT_FOLDER)
+    directory_listing_cache.init_app(app)
+    directory_watcher.init_app(app, socketio=socketio)
+    directory_size_cache.init_app(app)
+    thumbnail_cache.init_app(app)
+    thumbnail_generator.init_app(app, thumbnail_cache=thumbnail_cache)
 
     with app.app_context():
         import_module('tux_control.middleware')
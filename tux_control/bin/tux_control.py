@@ -263,6 +263,7 @@ def celerydev():
             statedb=node_format(None, hostname),  # ctx.obj.app.conf.worker_state_db
             no_color=False,
             concurrency=5,
+            queues='tux-control,tux-control-low',
             schedule='/tmp/celery.db',
             beat=True
 
@@ -300,6 +301,7 @@ def celeryworker():
             statedb=node_format(None, hostname), #ctx.obj.app.conf.worker_state_db
             no_color=False,
             autoscale='10,1',
+            queues='tux-control,tux-control-low',
             without_gossip=True
 
         )
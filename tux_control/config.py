@@ -23,15 +23,21 @@ class CeleryConfig(HardCoded):
     CELERY_ACCEPT_CONTENT = ['json']
     CELERY_TASK_ACKS_LATE = True
     CELERY_WORKER_DISABLE_RATE_LIMITS = True
-    CELERY_IMPORTS = ('tux_control',)
+    CELERY_IMPORTS = ('tux_control', 'file')
     CELERY_RESULT_SERIALIZER = 'json'
     CELERY_RESULT_EXPIRES = 10 * 60  # Dispose of Celery Beat results after 10 minutes.
     CELERY_TASK_SERIALIZER = 'json'
     CELERY_TASK_TRACK_STARTED = True
     CELERY_TASK_DEFAULT_QUEUE = 'tux-control'
+    CELERY_TASK_ROUTES = {
+        'tux_control.tasks.file.file_trash_purge': {'queue': 'tux-control-low'},  # Slow disk cleanup must not delay other tasks
+        'tux_control.tasks.file.file_storage_gc': {'queue': 'tux-control-low'},
+        'tux_control.tasks.file.file_thumbnail_prefetch': {'queue': 'tux-control-low'},
+    }
 
     CELERY_BEAT_SCHEDULE = {
         'pacman-every-day': dict(task='tux_control.pacman_update', schedule=crontab(day_of_week='1')),
+        'file-storage-gc-every-hour': dict(task='tux_control.tasks.file.file_storage_gc', schedule=crontab(minute='30')),
     }
 
 
@@ -48,6 +54,33 @@ class Config(CeleryConfig):
     HOST = '0.0.0.0'
 
     DATA_STORAGE = '/tmp'
+    FILE_LIST_CHUNK_SIZE = 500  # Number of entries in one file/on-list-chunk message
+    FILE_LIST_SNAPSHOT_TTL = 60  # Seconds a sorted listing is kept for file/do-list-window
+    FILE_LIST_SNAPSHOT_MAX_ENTRIES = 200000  # Number of entries in all kept listings, least recently used are dropped over it
+    FILE_LIST_WINDOW_MAX = 1000  # Maximum number of entries in one file/on-list-window message
+    FILE_LIST_CACHE_SIZE = 32  # Number of directory listings kept in cache
+    FILE_LIST_CACHE_MAX_ENTRIES = 20000  # Bigger directories are not cached
+    FILE_WATCH_DEBOUNCE = 0.1  # Seconds to collect inotify events before file/on-change is emitted
+    FILE_SEARCH_MAX_RESULTS = 1000  # Search stops after this number of matches
+    FILE_SEARCH_TIME_BUDGET = 30  # Search stops after this many seconds
+    FILE_SEARCH_WORKERS = 2  # Number of workers walking searched tree
+    FILE_SEARCH_BATCH_SIZE = 100  # Number of matches in one file/on-search-results message
+    FILE_SIZE_CACHE_SIZE = 10000  # Number of directories with cached size
+    FILE_SIZE_CACHE_TTL = 300  # Seconds cached directory size is trusted
+    FILE_TRASH_PURGE_DELAY = 60 * 60  # Seconds deleted files can be restored from trash before they are purged
+    FILE_TRASH_PURGE_BATCH = 100  # Number of unlinks between pauses when purging trash
+    FILE_TRASH_PURGE_PAUSE = 0.05  # Seconds to pause between batches when purging trash
+    FILE_CACHE_MAX_AGE = 0  # Seconds browser may reuse downloaded file without revalidation, 0 means always revalidate
+    THUMBNAIL_CACHE_MAX_AGE = 5 * 60  # Seconds browser may reuse thumbnail without revalidation
+    THUMBNAIL_STORAGE_BUDGET = 256 * 1024 * 1024  # Bytes of stored thumbnails, least recently used are removed over it
+    THUMBNAIL_WORKERS = 2  # Number of files decoded at once in threads generating thumbnails
+    THUMBNAIL_TIMEOUT = 60  # Seconds request waits for generated thumbnail before icon is sent instead
+    THUMBNAIL_BATCH_MAX = 200  # Maximum number of thumbnails in one file/do-get-thumbnails request
+    THUMBNAIL_SIZES = ['x100', '300x300', '1280x1280']  # Dimensions rendered together from one decode of the file
+    THUMBNAIL_FORMAT = 'jpeg'  # Format of stored thumbnails, jpeg or webp (smaller, not supported by old browsers)
+    THUMBNAIL_QUALITY = 85  # Encoder quality of thumbnails
+    THUMBNAIL_STORAGE = 'pack'  # Storage of thumbnails, pack (one append only file, compacted by file_storage_gc) or files (file per thumbnail)
+    UPLOAD_MAX_AGE = 24 * 60 * 60  # Seconds since last received chunk after which unfinished upload is removed
 
     JWT_ERROR_MESSAGE_KEY = 'message'
     JWT_TOKEN_LOCATION = ('headers', 'json', 'query_string')
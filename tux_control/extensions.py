@@ -15,6 +15,11 @@ from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from tux_control.plugin.PluginManager import PluginManager
 from tux_control.tools.package_manager.PackageManager import PackageManager
+from tux_control.tools.DirectoryListingCache import DirectoryListingCache
+from tux_control.tools.DirectoryWatcher import DirectoryWatcher
+from tux_control.tools.DirectorySizeCache import DirectorySizeCache
+from tux_control.tools.ThumbnailCache import ThumbnailCache
+from tux_control.tools.ThumbnailGenerator import ThumbnailGenerator
 
 LOG = getLogger(__name__)
 APP_ROOT_FOLDER = os.path.abspath(os.path.dirname(app_root.__file__))
@@ -30,3 +35,8 @@ package_manager = PackageManager()
 plugin_manager = PluginManager()
 jwt = JWTManager()
 cors = CORS()
+directory_listing_cache = DirectoryListingCache()
+directory_watcher = DirectoryWatcher()
+directory_size_cache = DirectorySizeCache()
+thumbnail_cache = ThumbnailCache()
+thumbnail_generator = ThumbnailGenerator()
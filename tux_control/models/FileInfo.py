@@ -1,60 +1,204 @@
+import os
+import pwd
 import datetime
 import stat
+import functools
+import threading
+import mimetypes
 import magic
 from pathlib import Path
 from flask_jwt_extended import current_user
 from tux_control.tools.IDictify import IDictify
 
+_magic_mime = None
+_magic_mime_lock = threading.Lock()
 
-class FileInfo(IDictify):
-    is_writable = False
-    is_readable = False
-    updated = None
-    created = None
-    size = 0
 
-    def __init__(self, path: Path, resolve_parents: bool = True):
-        self.path = path
+def _get_magic() -> magic.Magic:
+    """
+    Returns libmagic handle shared by the whole process, handle is created on first use only.
+    Under eventlet threading.local is per green thread, so the handle is not kept there; calls on the shared
+    handle are serialized by its own lock and libmagic never yields to the hub while holding it
+    @return:
+    """
+    global _magic_mime
+    if _magic_mime is None:
+        with _magic_mime_lock:
+            if _magic_mime is None:
+                _magic_mime = magic.Magic(mime=True)
+    return _magic_mime
 
-        self.name = self.path.name
-        self.suffix = self.path.suffix.strip('.')
-        self.parts = self.path.parts
-        self.is_dir = self.path.is_dir()
-        self.is_file = self.path.is_file()
-        self.stem = self.path.stem
-        self.absolute = str(path.absolute())
 
-        if path.is_file():
-            mime = magic.Magic(mime=True)
-            self.mime_type = mime.from_file(self.absolute)
-        else:
-            self.mime_type = None
+@functools.lru_cache(maxsize=256)
+def _get_owner_name(uid: int) -> str:
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return None
 
-        self.owner = path.owner() if self.is_file or self.is_dir else None
 
-        self.parent = FileInfo(self.path.parent, False) if resolve_parents else None
-        self.parents = [FileInfo(p, False) for p in self.path.parents] if resolve_parents else None
-
-        stat_info = path.stat() if self.is_file or self.is_dir else None
+class FileInfo(IDictify):
+    """
+    Information about file or directory, everything is derived from a single stat call
+    """
+    __slots__ = (
+        'path',
+        'name',
+        'absolute',
+        'is_dir',
+        'is_file',
+        'stat_info',
+        '_resolve_parents',
+        '_system_user',
+        '_parent',
+        '_parents',
+        '_mime_type',
+        '_content_mime_type',
+    )
+
+    def __init__(self, path: Path, resolve_parents: bool = True, stat_info: os.stat_result = None, system_user: str = None):
+        self.path = path
+        self.name = path.name
+        self.absolute = str(path.absolute())
 
-        if stat_info:
-            self.size = stat_info.st_size
+        if stat_info is None:
+            try:
+                stat_info = os.stat(self.absolute)
+            except OSError:
+                stat_info = None
+
+        self.stat_info = stat_info
+        self.is_dir = stat.S_ISDIR(stat_info.st_mode) if stat_info else False
+        self.is_file = stat.S_ISREG(stat_info.st_mode) if stat_info else False
+
+        self._resolve_parents = resolve_parents
+        self._system_user = system_user
+        self._parent = None
+        self._parents = None
+        self._mime_type = None
+        self._content_mime_type = None
+
+    @property
+    def suffix(self) -> str:
+        return self.path.suffix.strip('.')
+
+    @property
+    def stem(self) -> str:
+        return self.path.stem
+
+    @property
+    def parts(self) -> tuple:
+        return self.path.parts
+
+    @property
+    def owner(self) -> str:
+        return _get_owner_name(self.stat_info.st_uid) if self.stat_info else None
+
+    @property
+    def size(self) -> int:
+        return self.stat_info.st_size if self.stat_info else 0
+
+    @property
+    def updated(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.stat_info.st_mtime) if self.stat_info else None
+
+    @property
+    def created(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.stat_info.st_ctime) if self.stat_info else None
+
+    @property
+    def system_user(self) -> str:
+        if self._system_user is None:
+            self._system_user = current_user.system_user
+        return self._system_user
+
+    @property
+    def is_writable(self) -> bool:
+        if not self.stat_info:
+            return False
+        mode = self.stat_info.st_mode
+        return (bool(mode & stat.S_IWUSR) and self.owner == self.system_user) or bool(mode & stat.S_IWOTH)
 
-            self.updated = datetime.datetime.fromtimestamp(stat_info.st_mtime)
-            self.created = datetime.datetime.fromtimestamp(stat_info.st_ctime)
+    @property
+    def is_readable(self) -> bool:
+        if not self.stat_info:
+            return False
+        mode = self.stat_info.st_mode
+        return (bool(mode & stat.S_IRUSR) and self.owner == self.system_user) or bool(mode & stat.S_IROTH)
+
+    @property
+    def parent(self) -> 'FileInfo':
+        if not self._resolve_parents:
+            return None
+
+        if self._parent is None:
+            self._parent = FileInfo(self.path.parent, False, system_user=self._system_user)
+        return self._parent
+
+    @property
+    def parents(self) -> list:
+        if not self._resolve_parents:
+            return None
+
+        if self._parents is None:
+            self._parents = [FileInfo(p, False, system_user=self._system_user) for p in self.path.parents]
+        return self._parents
+
+    @property
+    def mime_type(self) -> str:
+        """
+        Mime type guessed from file suffix, does not touch file content
+        @return:
+        """
+        if not self.is_file:
+            return None
+
+        if self._content_mime_type:
+            return self._content_mime_type
+
+        if self._mime_type is None:
+            guessed_type, _ = mimetypes.guess_type(self.name, strict=False)
+            self._mime_type = guessed_type or 'application/octet-stream'
+        return self._mime_type
+
+    @property
+    def content_mime_type(self) -> str:
+        """
+        Mime type detected by libmagic from file content, use only when really serving the file
+        @return:
+        """
+        if not self.is_file:
+            return None
+
+        if self._content_mime_type is None:
+            self._content_mime_type = _get_magic().from_file(self.absolute)
+        return self._content_mime_type
 
-            self.is_writable = (bool(stat_info.st_mode & stat.S_IWUSR) and self.owner == current_user.system_user) or bool(stat_info.st_mode & stat.S_IWOTH)
-            self.is_readable = (bool(stat_info.st_mode & stat.S_IRUSR) and self.owner == current_user.system_user) or bool(stat_info.st_mode & stat.S_IROTH)
+    @staticmethod
+    def from_string(path: str, resolve_parents: bool = True, system_user: str = None) -> 'FileInfo':
+        return FileInfo(Path(path), resolve_parents, system_user=system_user)
 
     @staticmethod
-    def from_string(path: str, resolve_parents: bool = True) -> 'FileInfo':
-        return FileInfo(Path(path), resolve_parents)
+    def from_dir_entry(entry: os.DirEntry, resolve_parents: bool = True, system_user: str = None) -> 'FileInfo':
+        """
+        Builds FileInfo from os.scandir entry, reusing stat data cached by the entry
+        @param entry:
+        @param resolve_parents:
+        @param system_user: system user to evaluate permissions for, defaults to current user
+        @return:
+        """
+        try:
+            stat_info = entry.stat()
+        except OSError:
+            # Broken symlink or entry removed in the meantime
+            stat_info = None
+        return FileInfo(Path(entry.path), resolve_parents, stat_info, system_user)
 
     def is_allowed_file(self) -> bool:
         if self.name.startswith('.'):
             return False
 
-        if not self.path.is_file() and not self.path.is_dir():
+        if not self.is_file and not self.is_dir:
             return False
 
         if not self.is_writable:
@@ -62,11 +206,13 @@ class FileInfo(IDictify):
 
         return True
 
-    def to_dict(self):
-        return {
+    def to_dict(self, include_parents: bool = True) -> dict:
+        """
+        @param include_parents: serialize parent and parents, otherwise only absolute path of parent is referenced
+        @return:
+        """
+        file_dict = {
             'parts': self.parts,
-            'parent': self.parent,
-            'parents': self.parents,
             'name': self.name,
             'absolute': self.absolute,
             'suffix': self.suffix,
@@ -80,4 +226,12 @@ class FileInfo(IDictify):
             'size': self.size,
             'created': self.created.isoformat() if self.created else None,
             'updated': self.updated.isoformat() if self.updated else None,
-        }
\ No newline at end of file
+        }
+
+        if include_parents:
+            file_dict['parent'] = self.parent
+            file_dict['parents'] = self.parents
+        else:
+            file_dict['parent_absolute'] = str(self.path.parent)
+
+        return file_dict
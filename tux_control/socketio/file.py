@@ -1,55 +1,409 @@
 # -*- coding: utf-8 -*-
 import os.path
 import shutil
+import uuid
 
 import flask
 from pathlib import Path
+from typing import Union
 from flask_jwt_extended import current_user
+from flask_socketio import join_room, leave_room
 from tux_control.tools.jwt import jwt_required
 from tux_control.models.tux_control import Role, Permission
-from tux_control.extensions import db, socketio
+from tux_control.extensions import db, socketio, directory_listing_cache, directory_watcher, directory_size_cache, thumbnail_cache
 from tux_control.tools.acl import permission_required
 from tux_control.models.FileInfo import FileInfo
+from tux_control.tools.file_listing import scan_directory, chunked, list_directory, listing_envelope, ListingSnapshots, SORT_KEYS
+from tux_control.tools.FileSearch import FileSearch, parse_datetime
+from tux_control.tools.DirectorySizeCache import DirectorySizeState
 from tux_control.plugin.CurrentUser import CurrentUser
+from tux_control.tools import trash
+from tux_control.tools.thumbnails import dimensions_regex, is_previewable, get_thumbnail_etag, DEFAULT_DIMENSIONS
+from tux_control.tools.ThumbnailCache import ThumbnailCache
+from tux_control.tasks.file import file_batch, schedule_trash_purge, file_thumbnail_prefetch
 
 __author__ = "Adam Schubert"
 
 
-@socketio.on('file/do-list-all')
-@jwt_required()
-def do_list_all_file(data):
+listing_snapshots = ListingSnapshots()
+active_searches = {}
+
+
+def _get_listing_settings(data: dict, error_event: str) -> Union[tuple, None]:
     settings = data.get('settings', {})
     reversed_sort_order = True if settings.get('sort_order', 1) == -1 else False
     filters = settings.get('filters', {})
     sort_field = settings.get('sort_field', 'name')
-    search_path = Path(data.get('parent_file_info', {}).get('absolute', '/'))
+    search_path_info = FileInfo.from_string(data.get('parent_file_info', {}).get('absolute', '/'))
 
-    allowed_sort_fields = ['name', 'created', 'updated']
-    if sort_field not in allowed_sort_fields:
-        socketio.emit('file/on-list-all-error', {'message': 'This sort field is not allowed'}, room=flask.request.sid)
-        return
+    if sort_field not in SORT_KEYS:
+        socketio.emit(error_event, {'message': 'This sort field is not allowed'}, room=flask.request.sid)
+        return None
+
+    if not search_path_info.is_dir:
+        socketio.emit(error_event, {'message': 'Directory was not found', 'code': 404}, room=flask.request.sid)
+        return None
 
     glob_string = '*{}*'.format(filters.get('name', {}).get('value')) if filters.get('name') else '*'
 
-    matched_files = search_path.glob(glob_string)
+    return search_path_info, glob_string, sort_field, reversed_sort_order
+
+
+@socketio.on('file/do-list-all')
+@jwt_required()
+def do_list_all_file(data):
+    listing_settings = _get_listing_settings(data, 'file/on-list-all-error')
+    if not listing_settings:
+        return
+
+    search_path_info, glob_string, sort_field, reversed_sort_order = listing_settings
+
+    if data.get('stream'):
+        # Streamed listing is emitted in scandir order, client is responsible for sorting received rows
+        chunk_size = int(data.get('chunk_size', flask.current_app.config.get('FILE_LIST_CHUNK_SIZE', 500)))
+        total = 0
+        chunk_index = 0
+        for chunk in chunked(scan_directory(search_path_info.path, glob_string, cache=directory_listing_cache), max(chunk_size, 1)):
+            socketio.emit(
+                'file/on-list-chunk',
+                listing_envelope(search_path_info, chunk, index=chunk_index),
+                room=flask.request.sid
+            )
+            total += len(chunk)
+            chunk_index += 1
+            # Let other green threads (and the emit itself) run between chunks
+            socketio.sleep(0)
+
+        socketio.emit('file/on-list-done', {
+            'absolute': search_path_info.absolute,
+            'chunks': chunk_index,
+            'total': total,
+        }, room=flask.request.sid)
+        return
+
+    limit = int(data['limit']) if data.get('limit') else None
+    return_data, total = list_directory(search_path_info.path, glob_string, sort_field, reversed_sort_order, directory_listing_cache, limit)
+
+    socketio.emit('file/on-list-all', listing_envelope(search_path_info, return_data, total=total), room=flask.request.sid)
+
+
+@socketio.on('file/do-list-window')
+@jwt_required()
+def do_list_window_file(data):
+    listing_settings = _get_listing_settings(data, 'file/on-list-window-error')
+    if not listing_settings:
+        return
+
+    search_path_info, glob_string, sort_field, reversed_sort_order = listing_settings
+
+    window_max = flask.current_app.config.get('FILE_LIST_WINDOW_MAX', 1000)
+    try:
+        start = max(int(data.get('start', 0)), 0)
+        end = min(int(data.get('end', start + 50)), start + window_max)
+    except (TypeError, ValueError):
+        socketio.emit('file/on-list-window-error', {'message': 'Window start and end have to be integers', 'code': 400}, room=flask.request.sid)
+        return
+
+    snapshot_key = (flask.request.sid, search_path_info.absolute, sort_field, reversed_sort_order, glob_string)
+    snapshot = None
+    if not data.get('refresh'):
+        snapshot = listing_snapshots.get(snapshot_key, flask.current_app.config.get('FILE_LIST_SNAPSHOT_TTL', 60))
+
+    if snapshot is None:
+        snapshot, _ = list_directory(search_path_info.path, glob_string, sort_field, reversed_sort_order, directory_listing_cache)
+        listing_snapshots.put(
+            snapshot_key,
+            snapshot,
+            flask.current_app.config.get('FILE_LIST_SNAPSHOT_TTL', 60),
+            flask.current_app.config.get('FILE_LIST_SNAPSHOT_MAX_ENTRIES', 200000)
+        )
+
+    socketio.emit('file/on-list-window', listing_envelope(
+        search_path_info,
+        snapshot[start:end],
+        start=start,
+        end=min(max(end, start), len(snapshot)),
+        total=len(snapshot)
+    ), room=flask.request.sid)
+
+
+@socketio.on('file/do-get-listing-cache-stats')
+@jwt_required()
+def do_get_listing_cache_stats(data):
+    socketio.emit('file/on-get-listing-cache-stats', directory_listing_cache.get_stats(), room=flask.request.sid)
+
+
+@socketio.on('file/do-watch')
+@jwt_required()
+def do_watch_file(data):
+    directory_info = FileInfo.from_string(data.get('absolute', '/'), False)
+    if not directory_info.is_dir:
+        socketio.emit('file/on-watch-error', {'message': 'Directory was not found', 'code': 404}, room=flask.request.sid)
+        return
+
+    try:
+        room = directory_watcher.subscribe(flask.request.sid, directory_info.absolute, current_user.system_user)
+    except OSError as e:
+        # No inotify support or limit of watches (fs.inotify.max_user_watches) is reached
+        socketio.emit('file/on-watch-error', {'absolute': directory_info.absolute, 'message': str(e), 'code': 500}, room=flask.request.sid)
+        return
+
+    join_room(room)
+
+    socketio.emit('file/on-watch', {'absolute': directory_info.absolute}, room=flask.request.sid)
+
+
+@socketio.on('file/do-unwatch')
+@jwt_required()
+def do_unwatch_file(data):
+    absolute = str(Path(data.get('absolute', '/')).absolute())
+    room = directory_watcher.unsubscribe(flask.request.sid, absolute)
+    if room:
+        leave_room(room)
+
+    socketio.emit('file/on-unwatch', {'absolute': absolute}, room=flask.request.sid)
+
+
+@socketio.on('file/do-search')
+@jwt_required()
+def do_search_file(data):
+    sid = flask.request.sid
+    search_id = data.get('search_id') or str(uuid.uuid4())
+    config = flask.current_app.config
+
+    system_user = CurrentUser.get_system_user()
+    allowed_root = Path(system_user.home_directory).resolve()
+    search_root = Path(data.get('absolute') or allowed_root).resolve()
+    if search_root != allowed_root and allowed_root not in search_root.parents:
+        socketio.emit('file/on-search-error', {'search_id': search_id, 'message': 'You have no permission to search in this directory', 'code': 403}, room=sid)
+        return
+
+    if not search_root.is_dir():
+        socketio.emit('file/on-search-error', {'search_id': search_id, 'message': 'Directory was not found', 'code': 404}, room=sid)
+        return
+
+    max_results = config.get('FILE_SEARCH_MAX_RESULTS', 1000)
+    try:
+        size_min = int(data['size_min']) if data.get('size_min') not in (None, '') else None
+        size_max = int(data['size_max']) if data.get('size_max') not in (None, '') else None
+        updated_from = parse_datetime(data.get('updated_from'))
+        updated_to = parse_datetime(data.get('updated_to'))
+        max_results = min(int(data.get('max_results', max_results)), max_results)
+    except (TypeError, ValueError, AttributeError):
+        socketio.emit('file/on-search-error', {'search_id': search_id, 'message': 'Search filters have a wrong format', 'code': 400}, room=sid)
+        return
+
+    def on_batch(batch: list):
+        socketio.emit('file/on-search-results', {
+            'search_id': search_id,
+            'data': [file_info.to_dict(False) for file_info in batch],
+        }, room=sid)
+
+    file_search = FileSearch(
+        search_root,
+        system_user.username,
+        on_batch,
+        socketio.start_background_task,
+        socketio.sleep,
+        name=data.get('name'),
+        file_type=data.get('type'),
+        size_min=size_min,
+        size_max=size_max,
+        updated_from=updated_from,
+        updated_to=updated_to,
+        max_results=max_results,
+        time_budget=config.get('FILE_SEARCH_TIME_BUDGET', 30),
+        workers=config.get('FILE_SEARCH_WORKERS', 2),
+        batch_size=config.get('FILE_SEARCH_BATCH_SIZE', 100)
+    )
+
+    previous_search = active_searches.get((sid, search_id))
+    if previous_search:
+        previous_search.cancel()
+    active_searches[(sid, search_id)] = file_search
+
+    def run_search():
+        try:
+            file_search.run()
+        finally:
+            if active_searches.get((sid, search_id)) is file_search:
+                del active_searches[(sid, search_id)]
+
+            socketio.emit('file/on-search-done', dict(search_id=search_id, **file_search.to_dict()), room=sid)
+
+    socketio.emit('file/on-search', {'search_id': search_id, 'absolute': str(search_root)}, room=sid)
+    socketio.start_background_task(run_search)
+
+
+@socketio.on('file/do-search-cancel')
+@jwt_required()
+def do_search_cancel_file(data):
+    file_search = active_searches.get((flask.request.sid, data.get('search_id')))
+    if file_search:
+        file_search.cancel()
+
+
+@socketio.on('file/do-get-size')
+@jwt_required()
+def do_get_size_file(data):
+    sid = flask.request.sid
+    directory_info = FileInfo.from_string(data.get('absolute', '/'), False)
+    if not directory_info.is_dir:
+        socketio.emit('file/on-get-size-error', {'absolute': directory_info.absolute, 'message': 'Directory was not found', 'code': 404}, room=sid)
+        return
+
+    if not directory_info.is_allowed_file():
+        socketio.emit('file/on-get-size-error', {'absolute': directory_info.absolute, 'message': 'You have no permission to access this directory', 'code': 403}, room=sid)
+        return
+
+    def on_progress(state: DirectorySizeState):
+        socketio.emit('file/on-get-size-progress', dict(absolute=directory_info.absolute, **state.to_dict()), room=sid)
+
+    def calculate_size():
+        try:
+            state = directory_size_cache.calculate(directory_info.absolute, on_progress, socketio.sleep)
+        except OSError as e:
+            socketio.emit('file/on-get-size-error', {'absolute': directory_info.absolute, 'message': str(e), 'code': 500}, room=sid)
+            return
+
+        socketio.emit('file/on-get-size', dict(absolute=directory_info.absolute, **state.to_dict()), room=sid)
+
+    socketio.start_background_task(calculate_size)
+
+
+@socketio.on('file/do-prefetch-thumbnails')
+@jwt_required()
+@permission_required('file.read')
+def do_prefetch_thumbnails_file(data):
+    listing_settings = _get_listing_settings(data, 'file/on-prefetch-thumbnails-error')
+    if not listing_settings:
+        return
+
+    search_path_info, glob_string, sort_field, reversed_sort_order = listing_settings
 
-    # Sort dirs first
-    files = []
-    dirs = []
-    for matched_file in matched_files:
-        file_info = FileInfo(matched_file)
-        if not file_info.is_allowed_file():
+    dimensions = data.get('dimensions')
+    if dimensions and not dimensions_regex.match(dimensions):
+        socketio.emit('file/on-prefetch-thumbnails-error', {'message': 'Dimensions have a wrong format', 'code': 400}, room=flask.request.sid)
+        return
+
+    # Thumbnails are generated in the order entries are shown, so the first screen is ready first
+    limit = int(data['limit']) if data.get('limit') else None
+    file_infos, _ = list_directory(search_path_info.path, glob_string, sort_field, reversed_sort_order, directory_listing_cache, limit)
+    paths = [file_info.absolute for file_info in file_infos if is_previewable(file_info)]
+    if paths:
+        file_thumbnail_prefetch.delay(flask.request.sid, paths, dimensions)
+
+    socketio.emit('file/on-prefetch-thumbnails', {
+        'absolute': search_path_info.absolute,
+        'dimensions': dimensions,
+        'total': len(paths),
+    }, room=flask.request.sid)
+
+
+@socketio.on('file/do-get-thumbnails')
+@jwt_required()
+@permission_required('file.read')
+def do_get_thumbnails_file(data):
+    sid = flask.request.sid
+    dimensions = data.get('dimensions')
+    if dimensions and not dimensions_regex.match(dimensions):
+        socketio.emit('file/on-get-thumbnails-error', {'message': 'Dimensions have a wrong format', 'code': 400}, room=sid)
+        return
+
+    paths = data.get('paths', [])
+    batch_max = flask.current_app.config.get('THUMBNAIL_BATCH_MAX', 200)
+    if len(paths) > batch_max:
+        socketio.emit('file/on-get-thumbnails-error', {'message': 'At most {} thumbnails can be requested at once'.format(batch_max), 'code': 400}, room=sid)
+        return
+
+    # Authorization is paid once per batch, ready thumbnails are sent as binary attachments of one message
+    thumbnails = []
+    missing_paths = []
+    for index, path in enumerate(paths):
+        file_info = FileInfo.from_string(path, False)
+        if not file_info.is_file or not file_info.is_allowed_file():
+            thumbnails.append({'absolute': file_info.absolute, 'ready': False, 'code': 404})
             continue
 
-        if matched_file.is_dir():
-            dirs.append(file_info)
-        elif matched_file.is_file():
-            files.append(file_info)
+        thumbnail_data = thumbnail_cache.get(ThumbnailCache.get_key(file_info.stat_info), dimensions or DEFAULT_DIMENSIONS)
+        if thumbnail_data is None:
+            previewable = is_previewable(file_info)
+            if previewable:
+                missing_paths.append(file_info.absolute)
+            thumbnails.append({'absolute': file_info.absolute, 'ready': False, 'code': 202 if previewable else 415})
+        else:
+            thumbnails.append({
+                'absolute': file_info.absolute,
+                'ready': True,
+                'etag': get_thumbnail_etag(file_info, dimensions),
+                'mime_type': thumbnail_cache.mime_type,
+                'data': thumbnail_data,
+            })
+
+        if index and not index % 50:
+            socketio.sleep(0)
+
+    if missing_paths:
+        # Placeholders are replaced when file/on-thumbnail-ready or file/on-thumbnail-error arrives
+        file_thumbnail_prefetch.delay(sid, missing_paths, dimensions)
 
-    # Sort
-    return_data = sorted(dirs, key=lambda i: getattr(i, sort_field), reverse=reversed_sort_order) + sorted(files, key=lambda i: getattr(i, sort_field), reverse=reversed_sort_order)
+    socketio.emit('file/on-get-thumbnails', {'dimensions': dimensions, 'thumbnails': thumbnails}, room=sid)
 
-    socketio.emit('file/on-list-all', return_data, room=flask.request.sid)
+
+@socketio.on('file/do-batch')
+@jwt_required()
+@permission_required('file.edit')
+def do_batch_file(data):
+    sid = flask.request.sid
+    operation = data.get('operation')
+    if operation not in ('copy', 'move', 'delete'):
+        socketio.emit('file/on-batch-error', {'message': 'Unknown operation', 'code': 400}, room=sid)
+        return
+
+    if operation == 'delete' and not CurrentUser.has_permission('file.delete'):
+        socketio.emit('file/on-batch-error', {'message': 'You have no permission to delete files', 'code': 403}, room=sid)
+        return
+
+    sources = []
+    for file_info_raw in data.get('file_infos', []):
+        source_info = FileInfo.from_string(file_info_raw.get('absolute'), False)
+        if not (source_info.is_file or source_info.is_dir) or not source_info.is_allowed_file():
+            socketio.emit('file/on-batch-error', {'message': 'You have no permission to access {}'.format(source_info.absolute), 'code': 403}, room=sid)
+            return
+        sources.append(source_info)
+
+    if not sources:
+        socketio.emit('file/on-batch-error', {'message': 'No files were selected', 'code': 400}, room=sid)
+        return
+
+    destination = None
+    if operation in ('copy', 'move'):
+        destination_info = FileInfo.from_string(data.get('destination_file_info', {}).get('absolute', ''), False)
+        if not destination_info.is_dir or not destination_info.is_allowed_file():
+            socketio.emit('file/on-batch-error', {'message': 'You have no permission to write into destination', 'code': 403}, room=sid)
+            return
+
+        for source_info in sources:
+            if source_info.is_dir and (source_info.path == destination_info.path or source_info.path in destination_info.path.parents):
+                socketio.emit('file/on-batch-error', {'message': 'Directory can not be copied or moved into itself', 'code': 400}, room=sid)
+                return
+
+        destination = destination_info.absolute
+
+    job_id = str(uuid.uuid4())
+    file_batch.delay(job_id, sid, operation, [source_info.absolute for source_info in sources], destination, current_user.system_user)
+
+    socketio.emit('file/on-batch', {'job_id': job_id, 'operation': operation, 'total': len(sources)}, room=sid)
+
+
+@socketio.on('disconnect')
+def on_disconnect():
+    directory_watcher.unsubscribe_all(flask.request.sid)
+    listing_snapshots.remove_owner(flask.request.sid)
+
+    for sid, search_id in list(active_searches.keys()):
+        if sid == flask.request.sid:
+            active_searches[(sid, search_id)].cancel()
 
 
 @socketio.on('file/do-get-default')
@@ -100,8 +454,16 @@ def do_update_file(data):
         )
         return
 
-    new_file_parent_absolute = new_file_info_raw.get('parent', {}).get('absolute')
+    # Entries of listings carry only parent_absolute, entries of file/do-get the whole parent
+    new_file_parent_absolute = (new_file_info_raw.get('parent') or {}).get('absolute') or new_file_info_raw.get('parent_absolute')
     new_file_parent_info = FileInfo.from_string(new_file_parent_absolute) if new_file_parent_absolute else None
+    if not new_file_parent_info or not new_file_parent_info.is_dir:
+        socketio.emit(
+            'file/on-update-error',
+            {'message': 'Parent directory was not found', 'code': 400},
+            room=flask.request.sid
+        )
+        return
 
     # Find old file
     old_file_info = FileInfo.from_string(old_file_info_raw.get('absolute')) if old_file_info_raw else None
@@ -154,10 +516,68 @@ def do_delete_file(data):
         )
         return
 
-    if file_info_delete.is_file:
-        file_info_delete.path.unlink(missing_ok=True)
-    elif file_info_delete.is_dir:
-        file_info_delete.path.rmdir()
+    # Rename into trash is instant even for huge trees, content is purged later in background
+    try:
+        system_user = CurrentUser.get_system_user()
+        trash_item = trash.move_to_trash(file_info_delete.absolute, system_user)
+    except OSError as e:
+        socketio.emit(
+            'file/on-delete-error',
+            {'message': str(e), 'code': 500},
+            room=flask.request.sid
+        )
+        return
+
+    schedule_trash_purge(trash_item, system_user)
+
+    socketio.emit('file/on-delete', dict(trash_item=trash_item, **file_info_delete.to_dict()), room=flask.request.sid)
+
+
+@socketio.on('file/do-restore')
+@jwt_required()
+@permission_required('file.edit')
+def do_restore_file(data):
+    trash_directory = data.get('trash_directory', '')
+    name = data.get('name', '')
+    system_user = CurrentUser.get_system_user()
+    if not trash.is_trash_directory(trash_directory, system_user):
+        socketio.emit(
+            'file/on-restore-error',
+            {'message': 'You have no permission to access this trash', 'code': 403},
+            room=flask.request.sid
+        )
+        return
+
+    try:
+        trash_item = trash.restore_from_trash(trash_directory, name, system_user)
+    except PermissionError as e:
+        socketio.emit(
+            'file/on-restore-error',
+            {'message': str(e), 'code': 403},
+            room=flask.request.sid
+        )
+        return
+    except FileNotFoundError:
+        socketio.emit(
+            'file/on-restore-error',
+            {'message': 'File was not found in trash, it may be purged already', 'code': 404},
+            room=flask.request.sid
+        )
+        return
+    except FileExistsError:
+        socketio.emit(
+            'file/on-restore-error',
+            {'message': 'File with the same name already exists', 'code': 409},
+            room=flask.request.sid
+        )
+        return
+    except (OSError, ValueError) as e:
+        socketio.emit(
+            'file/on-restore-error',
+            {'message': str(e), 'code': 500},
+            room=flask.request.sid
+        )
+        return
 
-    socketio.emit('file/on-delete', file_info_delete.to_dict(), room=flask.request.sid)
+    socketio.emit('file/on-restore', FileInfo.from_string(trash_item['absolute']).to_dict(), room=flask.request.sid)
 
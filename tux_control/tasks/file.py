@@ -0,0 +1,212 @@
+import os
+import time
+import flask
+from logging import getLogger
+from typing import List
+from tux_control.extensions import celery, socketio, thumbnail_cache, thumbnail_generator
+from tux_control.tools import file_operations, trash
+from tux_control.tools.thumbnails import DEFAULT_DIMENSIONS
+from tux_control.tools.ChunkedUpload import ChunkedUpload
+from tux_control.tools.ThumbnailCache import ThumbnailCache
+from tux_control.tools.ThumbnailGenerator import render_thumbnails
+from tux_control.tools.pam import SystemUser, SystemUserRepository
+
+LOG = getLogger(__name__)
+PROGRESS_INTERVAL = 0.5
+
+
+@celery.task(bind=True, soft_time_limit=6 * 60 * 60, time_limit=6 * 60 * 60 + 60)
+def file_batch(self, job_id: str, sid: str, operation: str, sources: List[str], destination: str, system_user: str) -> dict:
+    """
+    Copies, moves or deletes files, progress is reported to requester sid
+    @param job_id: identifier of job known to client
+    @param sid: requester socket.io session id
+    @param operation: copy, move or delete
+    @param sources: absolute paths of processed files, already checked by caller
+    @param destination: absolute path of target directory for copy and move, already checked by caller
+    @param system_user: owner of created files
+    @return:
+    """
+    found_system_user = SystemUserRepository.find_by_name(system_user)
+    if operation == 'delete' and not found_system_user:
+        raise ValueError('System user {} was not found'.format(system_user))
+    uid = found_system_user.id if found_system_user else None
+    gid = found_system_user.group_id if found_system_user else None
+
+    progress = {
+        'job_id': job_id,
+        'operation': operation,
+        'total': len(sources),
+        'processed': 0,
+        'bytes': 0,
+        'current': None,
+    }
+    errors = []
+    last_progress = [0.0]
+
+    def emit_progress(force: bool = False):
+        now = time.monotonic()
+        if force or now - last_progress[0] >= PROGRESS_INTERVAL:
+            last_progress[0] = now
+            socketio.emit('file/on-batch-progress', progress, room=sid)
+
+    def on_bytes(copied: int):
+        progress['bytes'] += copied
+        emit_progress()
+
+    for source in sources:
+        progress['current'] = source
+        emit_progress(True)
+        try:
+            if operation == 'delete':
+                trash_item = trash.move_to_trash(source, found_system_user)
+                schedule_trash_purge(trash_item, found_system_user)
+            else:
+                target = os.path.join(destination, os.path.basename(source))
+                if os.path.lexists(target):
+                    raise FileExistsError('{} already exists'.format(target))
+
+                if operation == 'copy':
+                    for skipped in file_operations.copy(source, target, uid, gid, on_bytes):
+                        errors.append({'absolute': skipped, 'message': 'Not copied, permission denied or not a regular file'})
+                elif operation == 'move':
+                    file_operations.move(source, target, uid, gid, on_bytes)
+                else:
+                    raise ValueError('Unknown operation {}'.format(operation))
+        except Exception as e:
+            LOG.warning('File {} of {} failed: {}'.format(operation, source, e))
+            errors.append({'absolute': source, 'message': str(e)})
+
+        progress['processed'] += 1
+
+    progress['current'] = None
+    emit_progress(True)
+
+    result = {
+        'job_id': job_id,
+        'operation': operation,
+        'total': len(sources),
+        'processed': progress['processed'],
+        'bytes': progress['bytes'],
+        'errors': errors,
+    }
+    socketio.emit('file/on-batch-done', result, room=sid)
+    return result
+
+
+@celery.task(bind=True, soft_time_limit=6 * 60 * 60, time_limit=6 * 60 * 60 + 60)
+def file_trash_purge(self, trash_directory: str, name: str, system_user: str = None) -> int:
+    """
+    Deletes trashed item for good, task is routed to low priority queue and deleting is throttled
+    @param trash_directory: trash the item is in
+    @param name: name of item in trash
+    @param system_user: owner of trash, tasks scheduled by older versions have none and trash owner is used
+    @return: number of removed entries
+    """
+    if system_user:
+        found_system_user = SystemUserRepository.find_by_name(system_user)
+    else:
+        found_system_user = SystemUserRepository.find_by_id(os.lstat(trash_directory).st_uid)
+
+    if not found_system_user or not trash.is_trash_directory(trash_directory, found_system_user):
+        raise ValueError('{} is not trash of {}'.format(trash_directory, system_user))
+
+    removed = trash.purge_trash_item(
+        trash_directory,
+        name,
+        found_system_user,
+        flask.current_app.config.get('FILE_TRASH_PURGE_BATCH', 100),
+        flask.current_app.config.get('FILE_TRASH_PURGE_PAUSE', 0.05)
+    )
+    LOG.debug('Purged {} entries of {} from {}'.format(removed, name, trash_directory))
+    return removed
+
+
+def schedule_trash_purge(trash_item: dict, system_user: SystemUser) -> None:
+    """
+    Schedules purge of trashed item, item can be restored until the purge runs
+    @param trash_item: item returned by trash.move_to_trash
+    @param system_user: owner of trash
+    @return:
+    """
+    file_trash_purge.apply_async(
+        (trash_item['trash_directory'], trash_item['name'], system_user.username),
+        countdown=flask.current_app.config.get('FILE_TRASH_PURGE_DELAY', 3600)
+    )
+
+
+@celery.task(bind=True, soft_time_limit=30 * 60)
+def file_storage_gc(self) -> dict:
+    """
+    Removes abandoned uploads and keeps thumbnail store in its byte budget, runs periodically from Celery Beat
+    @return: reclaimed files and bytes
+    """
+    config = flask.current_app.config
+    result = {
+        'uploads_removed': 0,
+        'uploads_reclaimed': 0,
+        'thumbnails_removed': 0,
+        'thumbnails_reclaimed': 0,
+    }
+
+    uploads_directory = os.path.join(config.get('DATA_STORAGE'), 'uploads')
+    if os.path.isdir(uploads_directory):
+        result['uploads_removed'], result['uploads_reclaimed'] = ChunkedUpload.remove_stale(
+            uploads_directory,
+            config.get('UPLOAD_MAX_AGE', 24 * 60 * 60)
+        )
+
+    # Storage is also compacted here, see PackThumbnailStorage
+    result['thumbnails_removed'], result['thumbnails_reclaimed'] = thumbnail_cache.collect_garbage()
+
+    LOG.info('Removed {uploads_removed} abandoned uploads ({uploads_reclaimed} B) and {thumbnails_removed} thumbnails ({thumbnails_reclaimed} B)'.format(**result))
+    return result
+
+
+@celery.task(bind=True, soft_time_limit=30 * 60)
+def file_thumbnail_prefetch(self, sid: str, paths: List[str], dimensions: str = None) -> int:
+    """
+    Generates missing thumbnails of files, task is routed to low priority queue
+    @param sid: requester socket.io session id, notified about every ready or failed thumbnail
+    @param paths: absolute paths of files in order they are shown, already checked by caller
+    @param dimensions: requested dimensions
+    @return: number of generated thumbnails
+    """
+    size = dimensions or DEFAULT_DIMENSIONS
+    generated = 0
+
+    def emit_error(path: str, message: str, code: int):
+        # Placeholder is replaced by icon instead of waiting forever
+        socketio.emit('file/on-thumbnail-error', {'absolute': path, 'dimensions': dimensions, 'message': message, 'code': code}, room=sid)
+
+    for path in paths:
+        try:
+            key = ThumbnailCache.get_key(os.stat(path))
+        except OSError as e:
+            emit_error(path, str(e), 404)
+            continue
+
+        if not thumbnail_cache.get(key, size):
+            # Whole ladder of sizes is rendered from one decode, switching view does not need another one
+            try:
+                thumbnails = render_thumbnails(
+                    path,
+                    thumbnail_generator.get_missing_sizes(key, size),
+                    thumbnail_cache.image_format,
+                    thumbnail_generator.quality
+                )
+            except Exception as e:
+                LOG.warning('Thumbnail of {} failed: {}'.format(path, e))
+                emit_error(path, str(e), 500)
+                continue
+
+            if thumbnails is None:
+                emit_error(path, 'File type is not supported', 415)
+                continue
+
+            thumbnail_cache.put(key, thumbnails)
+            generated += 1
+
+        socketio.emit('file/on-thumbnail-ready', {'absolute': path, 'dimensions': dimensions}, room=sid)
+
+    return generated
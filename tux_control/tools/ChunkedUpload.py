@@ -0,0 +1,546 @@
+import os
+import json
+import errno
+import hashlib
+import time
+import uuid
+import fcntl
+import shutil
+from typing import BinaryIO, List, Tuple, Union
+
+BLOCK_SIZE = 64 * 1024
+STAGING_DIRECTORY = '.tux-control-uploads'
+DIGEST_ALGORITHM = 'sha256'
+DIGEST_SIZE = hashlib.new(DIGEST_ALGORITHM).digest_size
+
+
+class ChunkedUpload:
+    """
+    Upload split into chunks, chunks may arrive concurrently and in any order.
+    Every chunk is written at its offset and marked in bitmap file (one byte per chunk, so concurrent marks never
+    overwrite each other), received chunks survive dropped connection and upload can be resumed.
+    Chunks are hashed while written, digest of file is digest of concatenated chunk digests,
+    so it does not depend on order of chunks and file is never read again.
+    Layout is changed only under lock of the upload, chunk requests never lock otherwise.
+    """
+    lock_timeout = 5
+
+    def __init__(self, uploads_directory: str, upload_id: str, info: dict = None):
+        self.uploads_directory = uploads_directory
+        self.id = upload_id
+        self.info = info or {}
+        self.info_path = os.path.join(uploads_directory, '{}.info'.format(upload_id))
+        self.bitmap_path = os.path.join(uploads_directory, '{}.bitmap'.format(upload_id))
+        self.digests_path = os.path.join(uploads_directory, '{}.digests'.format(upload_id))
+        self.lock_path = os.path.join(uploads_directory, '{}.lock'.format(upload_id))
+        self.part_path = self.info.get('part_path') or os.path.join(uploads_directory, '{}.part'.format(upload_id))
+
+    @staticmethod
+    def create(uploads_directory: str, parent_file: dict, system_user: str, size: int = None, chunks: int = None, chunk_size: int = None) -> 'ChunkedUpload':
+        """
+        Creates new upload
+        @param uploads_directory: directory holding state of uploads
+        @param parent_file: directory file is uploaded into
+        @param system_user: owner of upload
+        @param size: size of uploaded file when known upfront
+        @param chunks: number of chunks when known upfront
+        @param chunk_size: size of all chunks but the last one, see set_layout
+        @return:
+        """
+        upload = ChunkedUpload(uploads_directory, str(uuid.uuid4()), {
+            'parent_file': parent_file,
+            'system_user': system_user,
+            'size': None,
+            'chunks': None,
+        })
+
+        # Staged on the filesystem of destination, so finalize is a rename and not a copy of whole file
+        staging_directory = os.path.join(parent_file.get('absolute', ''), STAGING_DIRECTORY)
+        try:
+            directory_fd = ChunkedUpload._open_staging_directory(staging_directory, create=True)
+            try:
+                staged_part_name = '{}.part'.format(upload.id)
+                os.close(os.open(staged_part_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600, dir_fd=directory_fd))
+            finally:
+                os.close(directory_fd)
+            upload.part_path = os.path.join(staging_directory, staged_part_name)
+        except OSError:
+            # Read only or otherwise unusable destination, stage in uploads directory
+            with open(upload.part_path, 'wb'):
+                pass
+        upload.info['part_path'] = upload.part_path
+
+        upload._save_info()
+        if size is not None and chunks is not None:
+            try:
+                upload.set_layout(size, chunks, chunk_size)
+            except ValueError:
+                upload.remove()
+                raise
+
+        return upload
+
+    @staticmethod
+    def load(uploads_directory: str, upload_id: str) -> Union['ChunkedUpload', None]:
+        """
+        Loads existing upload
+        @param uploads_directory: directory holding state of uploads
+        @param upload_id:
+        @return: upload or None when it does not exist
+        """
+        try:
+            # Id is used in paths, accept only what create generates
+            upload_id = str(uuid.UUID(upload_id))
+        except (TypeError, ValueError):
+            return None
+
+        info_path = os.path.join(uploads_directory, '{}.info'.format(upload_id))
+        try:
+            with open(info_path, 'r') as info_file:
+                upload = ChunkedUpload(uploads_directory, upload_id, json.load(info_file))
+        except (OSError, ValueError):
+            return None
+
+        if not os.path.isfile(upload.part_path):
+            return None
+
+        return upload
+
+    @staticmethod
+    def remove_stale(uploads_directory: str, max_age: float) -> Tuple[int, int]:
+        """
+        Removes uploads without activity for max_age seconds and files left behind by uploads without info
+        @param uploads_directory: directory holding state of uploads
+        @param max_age: seconds since last written chunk
+        @return: number of removed uploads and reclaimed bytes
+        """
+        deadline = time.time() - max_age
+        removed = 0
+        reclaimed = 0
+        with os.scandir(uploads_directory) as entries:
+            upload_ids = {entry.name.split('.', 1)[0] for entry in entries if entry.is_file()}
+
+        for upload_id in upload_ids:
+            upload = ChunkedUpload.load(uploads_directory, upload_id)
+            if upload:
+                paths = upload._get_paths()
+            else:
+                # Info file is gone, but some of the other files are still there
+                upload = ChunkedUpload(uploads_directory, upload_id)
+                paths = [entry.path for entry in os.scandir(uploads_directory) if entry.name.startswith(upload_id)]
+
+            stat_infos = []
+            for path in paths:
+                try:
+                    stat_infos.append(os.lstat(path))
+                except FileNotFoundError:
+                    continue
+
+            if not stat_infos or max(stat_info.st_mtime for stat_info in stat_infos) > deadline:
+                continue
+
+            for path in paths:
+                if path == upload.part_path and upload.is_staged:
+                    # Removed by upload.remove through verified staging directory
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+
+            upload.remove()
+            removed += 1
+            reclaimed += sum(stat_info.st_size for stat_info in stat_infos)
+
+        return removed, reclaimed
+
+    @staticmethod
+    def _open_staging_directory(staging_directory: str, create: bool = False) -> int:
+        """
+        Opens staging directory without following symlinks, staging directory is in directory of user,
+        so user may replace it by symlink or own directory pointing writes of this process elsewhere
+        @param staging_directory: path of staging directory
+        @param create: creates staging directory when it does not exist
+        @return: file descriptor of staging directory
+        """
+        if create:
+            try:
+                os.mkdir(staging_directory, 0o700)
+            except FileExistsError:
+                pass
+
+        # Symlink fails with ELOOP
+        directory_fd = os.open(staging_directory, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW)
+        stat_info = os.fstat(directory_fd)
+        if stat_info.st_uid != os.geteuid() or stat_info.st_mode & 0o077:
+            os.close(directory_fd)
+            raise PermissionError(errno.EPERM, 'Staging directory is not owned by this process', staging_directory)
+
+        return directory_fd
+
+    @property
+    def is_staged(self) -> bool:
+        return os.path.basename(os.path.dirname(self.part_path)) == STAGING_DIRECTORY
+
+    def _open_part(self, flags: int) -> int:
+        """
+        Opens part file, staged one only through verified staging directory
+        @param flags: flags of os.open
+        @return: file descriptor of part file
+        """
+        if not self.is_staged:
+            return os.open(self.part_path, flags)
+
+        directory_fd = self._open_staging_directory(os.path.dirname(self.part_path))
+        try:
+            return os.open(os.path.basename(self.part_path), flags | os.O_NOFOLLOW, dir_fd=directory_fd)
+        finally:
+            os.close(directory_fd)
+
+    @property
+    def size(self) -> Union[int, None]:
+        return self.info.get('size')
+
+    @property
+    def chunks(self) -> Union[int, None]:
+        return self.info.get('chunks')
+
+    @property
+    def chunk_size(self) -> Union[int, None]:
+        # Unknown until client sends it or a chunk tells it, see _settle_chunk_size
+        return self.info.get('chunk_size')
+
+    @property
+    def system_user(self) -> str:
+        return self.info.get('system_user')
+
+    @property
+    def parent_file(self) -> dict:
+        return self.info.get('parent_file', {})
+
+    def _save_info(self) -> None:
+        # Replaced atomically, concurrent chunk requests may read it at any time
+        info_tmp_path = '{}.{}'.format(self.info_path, uuid.uuid4().hex)
+        with open(info_tmp_path, 'w') as info_file:
+            json.dump(self.info, info_file)
+        os.replace(info_tmp_path, self.info_path)
+
+    def _load_info(self) -> None:
+        # Other requests may have changed the layout meanwhile
+        with open(self.info_path, 'r') as info_file:
+            self.info = json.load(info_file)
+
+    def _lock(self) -> int:
+        # Serializes changes of the layout by concurrent chunk requests, own open file description for every lock
+        lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_fd
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    os.close(lock_fd)
+                    raise ValueError('Upload is locked by other request')
+                # Green sleep under eventlet, other requests are served meanwhile
+                time.sleep(0.01)
+
+    @staticmethod
+    def _unlock(lock_fd: int) -> None:
+        fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        os.close(lock_fd)
+
+    @staticmethod
+    def _is_valid_chunk_size(size: int, chunks: int, chunk_size: int) -> bool:
+        if chunks == 1:
+            return chunk_size == size
+        return chunk_size > 0 and chunk_size * (chunks - 1) < size <= chunk_size * chunks
+
+    def set_layout(self, size: int, chunks: int, chunk_size: int = None) -> None:
+        """
+        Sets size and number of chunks, clients not sending them on create send them with every chunk.
+        All chunks but the last one are chunk_size long, chunk i starts at i * chunk_size
+        @param size: size of uploaded file
+        @param chunks: number of chunks
+        @param chunk_size: size of all chunks but the last one, when client does not send it chunks tell it
+        @return:
+        """
+        if size < 0 or chunks < 1:
+            raise ValueError('Invalid size or number of chunks')
+
+        if chunks == 1:
+            chunk_size = size
+        elif chunk_size is not None and not self._is_valid_chunk_size(size, chunks, chunk_size):
+            raise ValueError('Chunk size does not match size and number of chunks')
+
+        if self.chunks is not None and (chunk_size is None or chunk_size == self.chunk_size):
+            if (self.size, self.chunks) != (size, chunks):
+                raise ValueError('Size or number of chunks does not match the upload')
+            return
+
+        # Concurrent first chunks of upload created without layout all get here, only one creates the layout
+        lock_fd = self._lock()
+        try:
+            self._load_info()
+            if self.chunks is None:
+                with open(self.digests_path, 'wb') as digests_file:
+                    digests_file.truncate(chunks * DIGEST_SIZE)
+
+                with open(self.bitmap_path, 'wb') as bitmap_file:
+                    bitmap_file.truncate(chunks)
+
+                self.info['size'] = size
+                self.info['chunks'] = chunks
+                self.info['chunk_size'] = chunk_size
+                self._save_info()
+            elif (self.size, self.chunks) != (size, chunks):
+                raise ValueError('Size or number of chunks does not match the upload')
+            elif chunk_size is not None:
+                self._settle_chunk_size(chunk_size)
+        finally:
+            self._unlock(lock_fd)
+
+    def _settle_chunk_size(self, chunk_size: int = None, first_chunk_length: int = None) -> Union[int, None]:
+        """
+        Settles size of chunks of client not sending it, caller holds the lock. Offset of every chunk but the first
+        one tells it exactly. Length of the first chunk tells it too unless the chunk was truncated, so it is only
+        a guess replaced by size told by offset, the first chunk has to be sent again then.
+        @param chunk_size: chunk size told by client or by offset of chunk
+        @param first_chunk_length: length of received first chunk
+        @return: chunk size or None when it is not known yet
+        """
+        self._load_info()
+        known_chunk_size = self.chunk_size
+        guessed = self.info.get('chunk_size_guessed', False)
+        if chunk_size is not None:
+            if not self._is_valid_chunk_size(self.size, self.chunks, chunk_size):
+                raise ValueError('Chunk offset does not match the upload layout')
+
+            if known_chunk_size is not None and known_chunk_size != chunk_size and not guessed:
+                raise ValueError('Chunk offset does not match the upload layout')
+
+            if known_chunk_size != chunk_size or guessed:
+                if known_chunk_size is not None and known_chunk_size != chunk_size:
+                    # Guess was made from truncated first chunk
+                    self._mark(0, False)
+                self.info['chunk_size'] = chunk_size
+                self.info['chunk_size_guessed'] = False
+                self._save_info()
+        elif first_chunk_length is not None and known_chunk_size is None:
+            if self._is_valid_chunk_size(self.size, self.chunks, first_chunk_length):
+                self.info['chunk_size'] = first_chunk_length
+                self.info['chunk_size_guessed'] = True
+                self._save_info()
+
+        return self.chunk_size
+
+    def write_chunk(self, index: int, offset: int, stream: BinaryIO, digest: str = None) -> int:
+        """
+        Copies chunk from stream to its offset in fixed size blocks and marks it as received when it has exactly
+        its length from the layout, chunk may be written again when retried
+        @param index: index of chunk
+        @param offset: offset of chunk in file
+        @param stream: content of chunk, read until its end
+        @param digest: hex digest of chunk sent by client, chunk is not marked as received when it does not match
+        @return: length of chunk
+        """
+        if self.chunks is None:
+            raise ValueError('Upload layout is not known')
+
+        if not 0 <= index < self.chunks:
+            raise ValueError('Chunk is out of bounds of the upload')
+
+        chunk_size = self.chunk_size
+        if index > 0 and (offset % index or chunk_size is None or chunk_size != offset // index):
+            if offset % index:
+                raise ValueError('Chunk offset does not match the upload layout')
+            lock_fd = self._lock()
+            try:
+                chunk_size = self._settle_chunk_size(offset // index)
+            finally:
+                self._unlock(lock_fd)
+        elif index == 0 and offset:
+            raise ValueError('Chunk offset does not match the upload layout')
+
+        # Length of the first chunk is not known when it is the first chunk received from client not sending chunk size
+        length = min(chunk_size, self.size - offset) if chunk_size is not None else None
+        limit = length if length is not None else self.size
+        chunk_hash = hashlib.new(DIGEST_ALGORITHM)
+        written = 0
+        part_fd = self._open_part(os.O_WRONLY)
+        try:
+            while True:
+                block = stream.read(BLOCK_SIZE)
+                if not block:
+                    break
+
+                if written + len(block) > limit:
+                    raise ValueError('Chunk is longer than {} bytes'.format(limit))
+
+                chunk_hash.update(block)
+                block_written = 0
+                while block_written < len(block):
+                    block_written += os.pwrite(part_fd, block[block_written:], offset + written + block_written)
+                written += block_written
+        finally:
+            os.close(part_fd)
+
+        if length is None:
+            lock_fd = self._lock()
+            try:
+                length = self._settle_chunk_size(first_chunk_length=written)
+                if length is None:
+                    self._mark(index, False)
+                    raise ValueError('Chunk has {} bytes, it does not match size and number of chunks'.format(written))
+                # Marked under the lock, so chunk telling other chunk size meanwhile unmarks it afterwards
+                return self._finish_chunk(index, written, length, chunk_hash, digest)
+            finally:
+                self._unlock(lock_fd)
+
+        return self._finish_chunk(index, written, length, chunk_hash, digest)
+
+    def _finish_chunk(self, index: int, written: int, length: int, chunk_hash, digest: Union[str, None]) -> int:
+        if written != length:
+            # Truncated chunk, e.g. dropped connection, retried chunk may have overwritten good data
+            self._mark(index, False)
+            raise ValueError('Chunk has {} bytes instead of {}'.format(written, length))
+
+        if digest and digest.lower() != chunk_hash.hexdigest():
+            # Retried chunk may have overwritten good data
+            self._mark(index, False)
+            raise ValueError('Chunk digest does not match')
+
+        digests_fd = os.open(self.digests_path, os.O_WRONLY)
+        try:
+            os.pwrite(digests_fd, chunk_hash.digest(), index * DIGEST_SIZE)
+        finally:
+            os.close(digests_fd)
+
+        self._mark(index, True)
+        return written
+
+    def _mark(self, index: int, received: bool) -> None:
+        try:
+            bitmap_fd = os.open(self.bitmap_path, os.O_WRONLY)
+        except FileNotFoundError:
+            raise ValueError('Upload is already finished')
+
+        try:
+            os.pwrite(bitmap_fd, b'\x01' if received else b'\x00', index)
+        finally:
+            os.close(bitmap_fd)
+
+    def get_digest(self) -> str:
+        """
+        Returns digest of uploaded file, valid only when all chunks were received
+        @return: hex digest of concatenated chunk digests
+        """
+        with open(self.digests_path, 'rb') as digests_file:
+            return hashlib.new(DIGEST_ALGORITHM, digests_file.read()).hexdigest()
+
+    def get_received(self) -> List[int]:
+        """
+        Returns indexes of received chunks
+        @return:
+        """
+        try:
+            with open(self.bitmap_path, 'rb') as bitmap_file:
+                bitmap = bitmap_file.read()
+        except FileNotFoundError:
+            return []
+
+        return [index for index, received in enumerate(bitmap) if received]
+
+    def is_complete(self) -> bool:
+        try:
+            with open(self.bitmap_path, 'rb') as bitmap_file:
+                bitmap = bitmap_file.read()
+        except FileNotFoundError:
+            return False
+
+        return len(bitmap) == self.chunks and b'\x00' not in bitmap
+
+    def claim_finalize(self) -> bool:
+        """
+        Only one of concurrent requests completing the upload finalizes it
+        @return: True when caller should finalize the upload
+        """
+        try:
+            os.rename(self.bitmap_path, '{}.done'.format(self.bitmap_path))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def finalize(self, name: str) -> str:
+        """
+        Moves uploaded file to its parent directory
+        @param name: name of uploaded file
+        @return: absolute path of uploaded file
+        """
+        destination = os.path.join(self.parent_file.get('absolute'), os.path.basename(name))
+        if self.is_staged:
+            directory_fd = self._open_staging_directory(os.path.dirname(self.part_path))
+            try:
+                part_name = os.path.basename(self.part_path)
+                if self.size != os.stat(part_name, dir_fd=directory_fd, follow_symlinks=False).st_size:
+                    raise ValueError('Size does not match!')
+                os.rename(part_name, destination, src_dir_fd=directory_fd)
+            finally:
+                os.close(directory_fd)
+            return destination
+
+        if self.size != os.path.getsize(self.part_path):
+            raise ValueError('Size does not match!')
+
+        try:
+            os.rename(self.part_path, destination)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(self.part_path, destination)
+        return destination
+
+    def _get_paths(self) -> List[str]:
+        return [self.part_path, self.info_path, self.bitmap_path, '{}.done'.format(self.bitmap_path), self.digests_path, self.lock_path]
+
+    def remove(self) -> None:
+        for path in self._get_paths():
+            if path != self.part_path and os.path.isfile(path):
+                os.remove(path)
+
+        if not self.is_staged:
+            if os.path.isfile(self.part_path):
+                os.remove(self.part_path)
+            return
+
+        staging_directory = os.path.dirname(self.part_path)
+        try:
+            directory_fd = self._open_staging_directory(staging_directory)
+        except OSError:
+            # Staging directory is gone or it is not ours anymore, nothing of it is removed
+            return
+
+        try:
+            os.unlink(os.path.basename(self.part_path), dir_fd=directory_fd)
+        except FileNotFoundError:
+            pass
+        finally:
+            os.close(directory_fd)
+
+        try:
+            os.rmdir(staging_directory)
+        except OSError:
+            # Other uploads into the same directory are in progress
+            pass
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'finished': False,
+            'file': None,
+            'size': self.size,
+            'chunks': self.chunks,
+            'chunk_size': self.chunk_size,
+            'received': self.get_received(),
+            'digest_algorithm': DIGEST_ALGORITHM,
+        }
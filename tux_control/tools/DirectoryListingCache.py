@@ -0,0 +1,154 @@
+import os
+import flask
+from logging import getLogger
+from collections import OrderedDict
+from typing import List, Tuple, Union
+from tux_control.tools.inotify import Inotify, IN_Q_OVERFLOW, IN_IGNORED
+
+LOG = getLogger(__name__)
+
+DirectoryEntries = List[Tuple[str, Union[os.stat_result, None]]]
+
+
+class DirectoryListingCache:
+    """
+    Bounded LRU cache of raw directory listings (entry name and stat result) keyed by absolute path.
+    Entries are invalidated by inotify watches, when inotify is not available directory mtime is checked instead.
+    """
+    name = 'directory_listing_cache'
+    app = None
+    max_size = 32
+    max_entries = 20000
+
+    def __init__(self, app: flask.Flask = None):
+        self.hits = 0
+        self.misses = 0
+        self._listings = OrderedDict()
+        self._watches = {}
+        self._inotify = None
+        self._inotify_failed = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: flask.Flask):
+        if not hasattr(app, 'extensions'):
+            app.extensions = dict()
+        if self.name in app.extensions:
+            raise ValueError('Already registered extension {}.'.format(self.name))
+        app.extensions[self.name] = self
+
+        self.app = app
+        self.max_size = app.config.get('FILE_LIST_CACHE_SIZE', self.max_size)
+        self.max_entries = app.config.get('FILE_LIST_CACHE_MAX_ENTRIES', self.max_entries)
+
+    def _get_inotify(self) -> Union[Inotify, None]:
+        if self._inotify is None and not self._inotify_failed:
+            try:
+                self._inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                LOG.warning('inotify is not available, falling back to directory mtime checks: {}'.format(e))
+                self._inotify_failed = True
+        return self._inotify
+
+    def _process_events(self) -> None:
+        if not self._inotify:
+            return
+
+        for event in self._inotify.read_events():
+            if event.mask & IN_Q_OVERFLOW:
+                # Events were lost, nothing cached can be trusted
+                self.clear()
+                return
+
+            directory = self._watches.get(event.wd)
+            if event.mask & IN_IGNORED:
+                self._watches.pop(event.wd, None)
+
+            if directory and directory in self._listings:
+                self._remove(directory)
+
+    def _remove(self, directory: str) -> None:
+        wd, _, _ = self._listings.pop(directory)
+        if wd is not None and self._watches.pop(wd, None) is not None:
+            self._inotify.rm_watch(wd)
+
+    def get(self, directory: str) -> Union[DirectoryEntries, None]:
+        self._process_events()
+
+        listing = self._listings.get(directory)
+        if listing is not None:
+            wd, stat_info, entries = listing
+            if wd is None and not self._is_unchanged(directory, stat_info):
+                self._remove(directory)
+            else:
+                self._listings.move_to_end(directory)
+                self.hits += 1
+                return entries
+
+        self.misses += 1
+        return None
+
+    def put(self, directory: str, entries: DirectoryEntries, stat_info: os.stat_result) -> None:
+        """
+        Stores listing of directory
+        @param directory: absolute path of listed directory
+        @param entries: listed entries
+        @param stat_info: stat of directory taken before it was listed
+        @return:
+        """
+        if len(entries) > self.max_entries:
+            return
+
+        self._process_events()
+        if directory in self._listings:
+            self._remove(directory)
+
+        wd = None
+        inotify = self._get_inotify()
+        if inotify:
+            try:
+                wd = inotify.add_watch(directory)
+            except OSError as e:
+                LOG.debug('Failed to watch {}: {}'.format(directory, e))
+
+            if wd in self._watches:
+                # Same inode is already watched under another path, rely on mtime check for this one
+                wd = None
+
+        # Directory changed while it was listed (or before watch was set up)
+        if not self._is_unchanged(directory, stat_info):
+            if wd is not None:
+                inotify.rm_watch(wd)
+            return
+
+        if wd is not None:
+            self._watches[wd] = directory
+        self._listings[directory] = (wd, stat_info, entries)
+
+        while len(self._listings) > self.max_size:
+            self._remove(next(iter(self._listings)))
+
+    def invalidate(self, directory: str) -> None:
+        if directory in self._listings:
+            self._remove(directory)
+
+    def clear(self) -> None:
+        for directory in list(self._listings.keys()):
+            self._remove(directory)
+
+    def get_stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._listings),
+            'max_size': self.max_size,
+            'inotify': self._inotify is not None,
+        }
+
+    @staticmethod
+    def _is_unchanged(directory: str, stat_info: os.stat_result) -> bool:
+        try:
+            current_stat_info = os.stat(directory)
+        except OSError:
+            return False
+        return (current_stat_info.st_ino, current_stat_info.st_mtime_ns) == (stat_info.st_ino, stat_info.st_mtime_ns)
@@ -0,0 +1,164 @@
+import os
+import stat
+import time
+import flask
+from collections import OrderedDict
+from typing import Callable, Tuple, Union
+
+
+class DirectorySizeState:
+    def __init__(self):
+        self.size = 0
+        self.files = 0
+        self.directories = 0
+
+    def to_dict(self) -> dict:
+        return {
+            'size': self.size,
+            'files': self.files,
+            'directories': self.directories,
+        }
+
+
+class DirectorySizeCache:
+    """
+    Computes recursive directory sizes. Sums of own entries of every directory are cached per directory
+    (device, inode, mtime), so unchanged directories are not listed again, totals are summed on every walk.
+    Symlinks are not followed.
+    """
+    name = 'directory_size_cache'
+    app = None
+    max_size = 10000
+    ttl = 300
+
+    def __init__(self, app: flask.Flask = None):
+        self._sizes = OrderedDict()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: flask.Flask):
+        if not hasattr(app, 'extensions'):
+            app.extensions = dict()
+        if self.name in app.extensions:
+            raise ValueError('Already registered extension {}.'.format(self.name))
+        app.extensions[self.name] = self
+
+        self.app = app
+        self.max_size = app.config.get('FILE_SIZE_CACHE_SIZE', self.max_size)
+        self.ttl = app.config.get('FILE_SIZE_CACHE_TTL', self.ttl)
+
+    def calculate(
+            self,
+            path: str,
+            on_progress: Callable[[DirectorySizeState], None] = None,
+            sleep: Callable[[float], None] = None,
+            progress_interval: float = 0.5
+    ) -> DirectorySizeState:
+        """
+        Calculates size of directory tree
+        @param path: directory
+        @param on_progress: called with running totals at most every progress_interval seconds
+        @param sleep: cooperative sleep called between directories, e.g. socketio.sleep
+        @param progress_interval: seconds between progress reports
+        @return:
+        """
+        state = DirectorySizeState()
+        last_progress = [time.monotonic()]
+
+        def report_progress():
+            if sleep:
+                sleep(0)
+            if on_progress and time.monotonic() - last_progress[0] >= progress_interval:
+                last_progress[0] = time.monotonic()
+                on_progress(state)
+
+        # Walked with explicit stack, recursion would hit recursion limit in deep trees
+        stack = [(path, os.stat(path))]
+        while stack:
+            directory_path, stat_info = stack.pop()
+            subdirectories = self._calculate(directory_path, stat_info, state)
+            report_progress()
+
+            # Only own entries are cached, change deep in the tree does not change mtime of its ancestors
+            for name in reversed(subdirectories):
+                subdirectory_path = os.path.join(directory_path, name)
+                try:
+                    subdirectory_stat_info = os.lstat(subdirectory_path)
+                except OSError:
+                    continue
+
+                if stat.S_ISDIR(subdirectory_stat_info.st_mode):
+                    stack.append((subdirectory_path, subdirectory_stat_info))
+
+        return state
+
+    def _calculate(self, path: str, stat_info: os.stat_result, state: DirectorySizeState) -> Tuple[str, ...]:
+        """
+        Adds own entries of directory to state
+        @param path: directory
+        @param stat_info: stat of directory
+        @param state: running totals
+        @return: names of subdirectories
+        """
+        key = (stat_info.st_dev, stat_info.st_ino, stat_info.st_mtime_ns)
+        cached = self._get(key)
+        if cached:
+            size, files, subdirectories = cached
+        else:
+            size, files, subdirectories, complete = self._scan(path, stat_info)
+            if complete:
+                # Partial result of unreadable directory is not cached
+                self._put(key, (size, files, subdirectories))
+
+        state.size += size
+        state.files += files
+        state.directories += 1
+        return subdirectories
+
+    @staticmethod
+    def _scan(path: str, stat_info: os.stat_result) -> Tuple[int, int, Tuple[str, ...], bool]:
+        """
+        Sums own entries of directory
+        @param path:
+        @param stat_info:
+        @return: size of directory and its files, number of files, names of subdirectories and whether all entries were read
+        """
+        size = stat_info.st_size
+        files = 0
+        subdirectories = []
+        complete = True
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.name)
+                        else:
+                            size += entry.stat(follow_symlinks=False).st_size
+                            files += 1
+                    except OSError:
+                        complete = False
+        except OSError:
+            complete = False
+
+        return size, files, tuple(subdirectories), complete
+
+    def _get(self, key: tuple) -> Union[Tuple[int, int, Tuple[str, ...]], None]:
+        cached = self._sizes.get(key)
+        if cached is None:
+            return None
+
+        created, result = cached
+        if time.monotonic() - created > self.ttl:
+            # Directory mtime does not change when content of a file in it does
+            del self._sizes[key]
+            return None
+
+        self._sizes.move_to_end(key)
+        return result
+
+    def _put(self, key: tuple, result: Tuple[int, int, Tuple[str, ...]]) -> None:
+        self._sizes[key] = (time.monotonic(), result)
+        self._sizes.move_to_end(key)
+        while len(self._sizes) > self.max_size:
+            self._sizes.popitem(last=False)
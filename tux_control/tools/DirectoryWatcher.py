@@ -0,0 +1,240 @@
+import os
+import select
+import flask
+from logging import getLogger
+from pathlib import Path
+from typing import Dict, List, Set, Union
+from tux_control.models.FileInfo import FileInfo
+from tux_control.tools.inotify import Inotify, InotifyEvent, IN_CREATE, IN_DELETE, IN_MODIFY, IN_ATTRIB, \
+    IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_DELETE_SELF, IN_MOVE_SELF, IN_IGNORED, IN_Q_OVERFLOW
+
+LOG = getLogger(__name__)
+
+
+class DirectoryWatcher:
+    """
+    Pushes changes of watched directories to subscribed socket.io clients.
+    All directories share one inotify instance read by single background task.
+    Names of entries visible to every subscribed system user are kept per directory, deleted entries cannot be
+    checked by is_allowed_file anymore, so only deletions of entries the user could see are pushed.
+    """
+    name = 'directory_watcher'
+    app = None
+    socketio = None
+    debounce = 0.1
+
+    def __init__(self, app: flask.Flask = None, **kwargs):
+        self._inotify = None
+        self._reader = None
+        self._watches: Dict[int, str] = {}
+        self._wds: Dict[str, int] = {}
+        self._subscriptions: Dict[str, Dict[str, str]] = {}
+        self._sids: Dict[str, Set[str]] = {}
+        self._visible: Dict[str, Dict[str, Set[str]]] = {}
+        if app is not None:
+            self.init_app(app, **kwargs)
+
+    def init_app(self, app: flask.Flask, socketio):
+        if not hasattr(app, 'extensions'):
+            app.extensions = dict()
+        if self.name in app.extensions:
+            raise ValueError('Already registered extension {}.'.format(self.name))
+        app.extensions[self.name] = self
+
+        self.app = app
+        self.socketio = socketio
+        self.debounce = app.config.get('FILE_WATCH_DEBOUNCE', self.debounce)
+
+    @staticmethod
+    def get_room(absolute: str, system_user: str) -> str:
+        return 'file/watch:{}:{}'.format(system_user, absolute)
+
+    def subscribe(self, sid: str, absolute: str, system_user: str) -> str:
+        """
+        Subscribes sid to changes of directory, caller is responsible for joining returned room
+        @param sid: socket.io session id
+        @param absolute: absolute path of watched directory
+        @param system_user: system user permissions of pushed FileInfo are evaluated for
+        @return: room name
+        """
+        if self._inotify is None:
+            self._inotify = Inotify()
+
+        if absolute not in self._wds:
+            wd = self._inotify.add_watch(absolute)
+            self._watches[wd] = absolute
+            self._wds[absolute] = wd
+
+        self._subscriptions.setdefault(absolute, {})[sid] = system_user
+        self._sids.setdefault(sid, set()).add(absolute)
+        visible = self._visible.setdefault(absolute, {})
+        if system_user not in visible:
+            visible[system_user] = self._list_visible(absolute, system_user)
+
+        if self._reader is None:
+            self._reader = self.socketio.start_background_task(self._read)
+
+        return self.get_room(absolute, system_user)
+
+    def unsubscribe(self, sid: str, absolute: str) -> Union[str, None]:
+        """
+        Unsubscribes sid from changes of directory, caller is responsible for leaving returned room
+        @param sid: socket.io session id
+        @param absolute: absolute path of watched directory
+        @return: room name or None when sid was not subscribed
+        """
+        subscriptions = self._subscriptions.get(absolute)
+        if not subscriptions or sid not in subscriptions:
+            return None
+
+        system_user = subscriptions.pop(sid)
+        self._sids.get(sid, set()).discard(absolute)
+        if not self._sids.get(sid):
+            self._sids.pop(sid, None)
+
+        if not subscriptions:
+            self._remove_watch(absolute)
+        elif system_user not in subscriptions.values():
+            self._visible.get(absolute, {}).pop(system_user, None)
+
+        return self.get_room(absolute, system_user)
+
+    def unsubscribe_all(self, sid: str) -> List[str]:
+        rooms = [self.unsubscribe(sid, absolute) for absolute in list(self._sids.get(sid, []))]
+        return [room for room in rooms if room]
+
+    def _remove_watch(self, absolute: str) -> None:
+        self._subscriptions.pop(absolute, None)
+        self._visible.pop(absolute, None)
+        wd = self._wds.pop(absolute, None)
+        if wd is not None:
+            self._watches.pop(wd, None)
+            self._inotify.rm_watch(wd)
+
+    @staticmethod
+    def _list_visible(absolute: str, system_user: str) -> Set[str]:
+        """
+        Lists names of entries in directory system user is allowed to see
+        @param absolute: absolute path of directory
+        @param system_user: system user permissions are evaluated for
+        @return:
+        """
+        try:
+            with os.scandir(absolute) as entries:
+                return {entry.name for entry in entries if FileInfo.from_dir_entry(entry, False, system_user).is_allowed_file()}
+        except OSError:
+            return set()
+
+    def _read(self) -> None:
+        try:
+            while self._watches:
+                readable, _, _ = select.select([self._inotify], [], [], 1.0)
+                if not readable:
+                    continue
+
+                # Give writers a moment so bursts of events are delivered together
+                self.socketio.sleep(self.debounce)
+                self._dispatch(self._inotify.read_events())
+        except Exception:
+            LOG.exception('Directory watcher failed')
+        finally:
+            self._reader = None
+
+    def _dispatch(self, events: List[InotifyEvent]) -> None:
+        changes = []
+        moved_from = {}
+        for event in events:
+            if event.mask & IN_Q_OVERFLOW:
+                # Events were lost, clients have to list watched directories again
+                changes = [(absolute, 'reset', None, None) for absolute in self._subscriptions.keys()]
+                moved_from = {}
+                break
+
+            absolute = self._watches.get(event.wd)
+            if not absolute:
+                continue
+
+            if event.mask & IN_IGNORED:
+                # Watched directory is gone, subscribers were notified by reset and keep their subscription until unwatch
+                del self._watches[event.wd]
+                self._wds.pop(absolute, None)
+                continue
+
+            if event.mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changes.append((absolute, 'reset', None, None))
+            elif event.mask & IN_CREATE:
+                changes.append((absolute, 'created', event.name, None))
+            elif event.mask & IN_DELETE:
+                changes.append((absolute, 'deleted', event.name, None))
+            elif event.mask & IN_MOVED_FROM:
+                moved_from[event.cookie] = (absolute, event.name)
+            elif event.mask & IN_MOVED_TO:
+                if event.cookie in moved_from:
+                    from_absolute, old_name = moved_from.pop(event.cookie)
+                    if from_absolute == absolute:
+                        changes.append((absolute, 'moved', event.name, old_name))
+                    else:
+                        changes.append((from_absolute, 'deleted', old_name, None))
+                        changes.append((absolute, 'created', event.name, None))
+                else:
+                    changes.append((absolute, 'created', event.name, None))
+            elif event.mask & (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE):
+                changes.append((absolute, 'modified', event.name, None))
+
+        # Moved out of watched directories
+        for from_absolute, old_name in moved_from.values():
+            changes.append((from_absolute, 'deleted', old_name, None))
+
+        emitted = set()
+        for change in changes:
+            if change in emitted:
+                continue
+            emitted.add(change)
+            self._emit_change(*change)
+
+    def _emit_change(self, absolute: str, event: str, name: Union[str, None], old_name: Union[str, None]) -> None:
+        if event != 'moved' and name and name.startswith('.'):
+            # Never visible, renaming visible entry to hidden name is handled below
+            return
+
+        visible = self._visible.get(absolute, {})
+        for system_user in set(self._subscriptions.get(absolute, {}).values()):
+            visible_names = visible.setdefault(system_user, set())
+            if event == 'reset':
+                visible[system_user] = self._list_visible(absolute, system_user)
+                self._emit(absolute, system_user, event, name, old_name, None)
+                continue
+
+            if event == 'deleted':
+                # Entry is gone, it was allowed when it was seen last time
+                if name in visible_names:
+                    visible_names.discard(name)
+                    self._emit(absolute, system_user, event, name, old_name, None)
+                continue
+
+            was_visible = (old_name if event == 'moved' else name) in visible_names
+            if event == 'moved':
+                visible_names.discard(old_name)
+
+            file_info = FileInfo(Path(absolute) / name, False, system_user=system_user)
+            if not file_info.is_allowed_file():
+                visible_names.discard(name)
+                if was_visible:
+                    # Hidden, gone again or not allowed anymore, client removes it as any other deleted entry
+                    self._emit(absolute, system_user, 'deleted', old_name if event == 'moved' else name, None, None)
+                continue
+
+            visible_names.add(name)
+            if event == 'moved' and not was_visible:
+                # Client never saw the old name
+                event, old_name = 'created', None
+            self._emit(absolute, system_user, event, name, old_name, file_info)
+
+    def _emit(self, absolute: str, system_user: str, event: str, name: Union[str, None], old_name: Union[str, None], file_info: Union[FileInfo, None]) -> None:
+        self.socketio.emit('file/on-change', {
+            'event': event,
+            'parent_absolute': absolute,
+            'name': name,
+            'old_name': old_name,
+            'file_info': file_info.to_dict(False) if file_info else None,
+        }, room=self.get_room(absolute, system_user))
@@ -0,0 +1,234 @@
+import os
+import time
+import fnmatch
+import datetime
+import threading
+from collections import deque
+from logging import getLogger
+from pathlib import Path
+from typing import Callable, List, Union
+from tux_control.models.FileInfo import FileInfo
+
+LOG = getLogger(__name__)
+
+
+class FileSearch:
+    """
+    Recursive search in directory tree, directories are walked by pool of workers and matches are reported in batches
+    """
+
+    def __init__(
+            self,
+            root: Path,
+            system_user: str,
+            on_batch: Callable[[List[FileInfo]], None],
+            start_task: Callable,
+            sleep: Callable[[float], None],
+            name: str = None,
+            file_type: str = None,
+            size_min: int = None,
+            size_max: int = None,
+            updated_from: datetime.datetime = None,
+            updated_to: datetime.datetime = None,
+            max_results: int = 1000,
+            time_budget: float = 30,
+            workers: int = 2,
+            batch_size: int = 100
+    ):
+        """
+        @param root: directory to search in
+        @param system_user: system user permissions are evaluated for
+        @param on_batch: called with every batch of found files
+        @param start_task: starts worker in background, e.g. socketio.start_background_task
+        @param sleep: cooperative sleep, e.g. socketio.sleep
+        @param name: pattern or part of name, case insensitive
+        @param file_type: 'file' or 'dir'
+        @param size_min: minimal size in bytes
+        @param size_max: maximal size in bytes
+        @param updated_from: minimal modification time
+        @param updated_to: maximal modification time
+        @param max_results: search ends when this number of files is found
+        @param time_budget: search ends after this many seconds
+        @param workers: number of workers walking the tree
+        @param batch_size: maximal number of files in one batch
+        """
+        self.root = root
+        self.system_user = system_user
+        self.on_batch = on_batch
+        self.start_task = start_task
+        self.sleep = sleep
+        self.file_type = file_type
+        self.size_min = size_min
+        self.size_max = size_max
+        self.updated_from = updated_from.timestamp() if updated_from else None
+        self.updated_to = updated_to.timestamp() if updated_to else None
+        self.max_results = max_results
+        self.time_budget = time_budget
+        self.workers = max(workers, 1)
+        self.batch_size = batch_size
+
+        self.name_pattern = None
+        if name:
+            name = name.lower()
+            self.name_pattern = name if any(c in name for c in '*?[') else '*{}*'.format(name)
+
+        self.total = 0
+        self.is_canceled = False
+        self.is_timed_out = False
+        self.is_truncated = False
+        self._directories = deque([str(root)])
+        self._batch = []
+        self._active_workers = 0
+        self._running_workers = 0
+        self._lock = threading.Lock()
+        self._deadline = None
+
+    @property
+    def is_stopped(self) -> bool:
+        return self.is_canceled or self.is_timed_out or self.is_truncated
+
+    def cancel(self) -> None:
+        self.is_canceled = True
+
+    def run(self) -> None:
+        """
+        Runs the search, blocks current (green) thread until all workers are done
+        @return:
+        """
+        self._deadline = time.monotonic() + self.time_budget
+        self._running_workers = self.workers
+        for _ in range(self.workers):
+            self.start_task(self._work)
+
+        while self._running_workers:
+            self.sleep(0.05)
+
+        self._flush()
+
+    def to_dict(self) -> dict:
+        return {
+            'total': self.total,
+            'is_canceled': self.is_canceled,
+            'is_timed_out': self.is_timed_out,
+            'is_truncated': self.is_truncated,
+        }
+
+    def _work(self) -> None:
+        try:
+            while not self.is_stopped:
+                if time.monotonic() > self._deadline:
+                    self.is_timed_out = True
+                    break
+
+                if not self._directories:
+                    if not self._active_workers:
+                        # Nothing to walk and nobody can add more
+                        break
+                    self.sleep(0.01)
+                    continue
+
+                with self._lock:
+                    if not self._directories:
+                        continue
+                    directory = self._directories.popleft()
+                    self._active_workers += 1
+                try:
+                    self._search_directory(directory)
+                finally:
+                    with self._lock:
+                        self._active_workers -= 1
+
+                # Let other green threads run between directories
+                self.sleep(0)
+        except Exception:
+            LOG.exception('File search failed')
+        finally:
+            with self._lock:
+                self._running_workers -= 1
+
+    def _search_directory(self, directory: str) -> None:
+        try:
+            dir_entries = os.scandir(directory)
+        except OSError:
+            return
+
+        with dir_entries:
+            for index, dir_entry in enumerate(dir_entries):
+                if self.is_stopped:
+                    return
+
+                if index and not index % 256:
+                    # Huge directories must not block other green threads either
+                    self.sleep(0)
+
+                if dir_entry.name.startswith('.'):
+                    continue
+
+                try:
+                    stat_info = dir_entry.stat()
+                    # Do not follow symlinked directories, they may create loops
+                    is_walkable = dir_entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+
+                file_info = FileInfo(Path(dir_entry.path), False, stat_info, self.system_user)
+                if not file_info.is_allowed_file():
+                    continue
+
+                if is_walkable:
+                    self._directories.append(dir_entry.path)
+
+                if self._is_match(file_info):
+                    self._add_result(file_info)
+
+    def _is_match(self, file_info: FileInfo) -> bool:
+        if self.name_pattern and not fnmatch.fnmatchcase(file_info.name.lower(), self.name_pattern):
+            return False
+
+        if self.file_type == 'file' and not file_info.is_file:
+            return False
+
+        if self.file_type == 'dir' and not file_info.is_dir:
+            return False
+
+        if self.size_min is not None and file_info.size < self.size_min:
+            return False
+
+        if self.size_max is not None and file_info.size > self.size_max:
+            return False
+
+        mtime = file_info.stat_info.st_mtime
+        if self.updated_from is not None and mtime < self.updated_from:
+            return False
+
+        if self.updated_to is not None and mtime > self.updated_to:
+            return False
+
+        return True
+
+    def _add_result(self, file_info: FileInfo) -> None:
+        with self._lock:
+            if self.total >= self.max_results:
+                self.is_truncated = True
+                return
+
+            self.total += 1
+            self._batch.append(file_info)
+            if len(self._batch) < self.batch_size:
+                return
+
+            batch, self._batch = self._batch, []
+
+        self.on_batch(batch)
+
+    def _flush(self) -> None:
+        with self._lock:
+            batch, self._batch = self._batch, []
+
+        if batch:
+            self.on_batch(batch)
+
+
+def parse_datetime(value: Union[str, None]) -> Union[datetime.datetime, None]:
+    # fromisoformat does not understand Z suffix sent by javascript clients
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
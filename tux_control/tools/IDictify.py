@@ -1,4 +1,6 @@
 
 class IDictify:
+    __slots__ = ()
+
     def to_dict(self) -> dict:
         raise NotImplementedError
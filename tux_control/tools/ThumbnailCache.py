@@ -0,0 +1,186 @@
+import os
+import hashlib
+import flask
+from logging import getLogger
+from collections import OrderedDict
+from typing import Dict, Tuple, Union
+from tux_control.tools.thumbnail_storage.IThumbnailStorage import IThumbnailStorage
+from tux_control.tools.thumbnail_storage.FileThumbnailStorage import FileThumbnailStorage
+from tux_control.tools.thumbnail_storage.PackThumbnailStorage import PackThumbnailStorage
+
+LOG = getLogger(__name__)
+
+IMAGE_FORMATS = {
+    'jpeg': ('jpg', 'image/jpeg'),
+    'webp': ('webp', 'image/webp'),
+}
+
+STORAGES = {
+    'pack': PackThumbnailStorage,
+    'files': FileThumbnailStorage,
+}
+
+
+class ThumbnailCache:
+    """
+    Store of generated thumbnails keyed by identity and version of source file (device, inode, size, mtime),
+    so a changed file never gets a stale thumbnail and files with the same name do not collide.
+    All sizes of one file are one entry, they are generated from one decode and evicted together.
+    Index of stored thumbnails is kept in memory in LRU order, misses check storage for thumbnails stored by other
+    processes and total size is kept under budget by evicting least recently used entries.
+    Thumbnails are kept in pluggable storage, see STORAGES.
+    """
+    name = 'thumbnail_cache'
+    app = None
+    directory = None
+    max_size = 256 * 1024 * 1024
+    image_format = 'jpeg'
+
+    def __init__(self, app: flask.Flask = None):
+        self.storage = None
+        self.hits = 0
+        self.misses = 0
+        self._index = None
+        self._size = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: flask.Flask):
+        if not hasattr(app, 'extensions'):
+            app.extensions = dict()
+        if self.name in app.extensions:
+            raise ValueError('Already registered extension {}.'.format(self.name))
+        app.extensions[self.name] = self
+
+        self.app = app
+        self.directory = os.path.join(app.config.get('DATA_STORAGE'), 'thumbnails')
+        self.max_size = app.config.get('THUMBNAIL_STORAGE_BUDGET', self.max_size)
+        self.image_format = app.config.get('THUMBNAIL_FORMAT', self.image_format)
+        if self.image_format not in IMAGE_FORMATS:
+            raise ValueError('Unsupported thumbnail format {}.'.format(self.image_format))
+
+        storage_name = app.config.get('THUMBNAIL_STORAGE', 'pack')
+        if storage_name not in STORAGES:
+            raise ValueError('Unsupported thumbnail storage {}.'.format(storage_name))
+        self.storage = STORAGES[storage_name](self.directory, self.extension)  # type: IThumbnailStorage
+
+    @property
+    def extension(self) -> str:
+        return IMAGE_FORMATS[self.image_format][0]
+
+    @property
+    def mime_type(self) -> str:
+        return IMAGE_FORMATS[self.image_format][1]
+
+    @staticmethod
+    def get_key(stat_info: os.stat_result) -> str:
+        """
+        Returns cache key of thumbnails of file
+        @param stat_info: stat of source file
+        @return:
+        """
+        identity = '{}:{}:{}:{}'.format(stat_info.st_dev, stat_info.st_ino, stat_info.st_size, stat_info.st_mtime_ns)
+        return hashlib.sha1(identity.encode('UTF-8')).hexdigest()
+
+    def _get_index(self) -> OrderedDict:
+        if self._index is None:
+            # Stored thumbnails survive restart, most recently used are last
+            stored = {}
+            for key, dimensions, size, recency in self.storage.load():
+                entry = stored.setdefault(key, [recency, {}])
+                entry[0] = max(entry[0], recency)
+                entry[1][dimensions] = size
+
+            self._index = OrderedDict(
+                (key, sizes) for key, (_, sizes) in sorted(stored.items(), key=lambda item: item[1][0])
+            )
+            self._size = sum(sum(sizes.values()) for sizes in self._index.values())
+
+        return self._index
+
+    def get(self, key: str, dimensions: str) -> Union[bytes, None]:
+        """
+        Returns stored thumbnail
+        @param key:
+        @param dimensions: size of thumbnail
+        @return: encoded image or None when thumbnail is not stored
+        """
+        index = self._get_index()
+        known = dimensions in index.get(key, ())
+
+        # Thumbnail may be stored by other process (e.g. Celery worker prefetching thumbnails) or removed by it
+        thumbnail = self.storage.read(key, dimensions)
+        if thumbnail is None:
+            if known:
+                self.invalidate(key)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._add(key, dimensions, len(thumbnail))
+        if not known:
+            self._evict(keep=key)
+        return thumbnail
+
+    def contains(self, key: str, dimensions: str) -> bool:
+        # Checks only the index, does not count as hit nor miss
+        return dimensions in self._get_index().get(key, ())
+
+    def put(self, key: str, thumbnails: Dict[str, bytes]) -> None:
+        """
+        Stores thumbnails of file and evicts least recently used entries over budget
+        @param key:
+        @param thumbnails: encoded images by their size
+        @return:
+        """
+        if not self.storage.write(key, thumbnails):
+            return
+
+        for dimensions, thumbnail in thumbnails.items():
+            self._add(key, dimensions, len(thumbnail))
+
+        self._evict(keep=key)
+
+    def _add(self, key: str, dimensions: str, size: int) -> None:
+        index = self._get_index()
+        sizes = index.setdefault(key, {})
+        self._size += size - sizes.get(dimensions, 0)
+        sizes[dimensions] = size
+        index.move_to_end(key)
+
+    def invalidate(self, key: str) -> None:
+        """
+        Forgets thumbnails of file, used when they disappear from storage (e.g. removed by file_storage_gc)
+        @param key:
+        @return:
+        """
+        index = self._get_index()
+        if key in index:
+            self._size -= sum(index.pop(key).values())
+
+    def _evict(self, keep: str) -> None:
+        # Entry just used is the most recent one, it is never evicted even when it alone is over budget
+        index = self._get_index()
+        while self._size > self.max_size and next(iter(index)) != keep:
+            key, sizes = index.popitem(last=False)
+            self._size -= sum(sizes.values())
+            self.storage.remove(key, sizes.keys())
+
+    def collect_garbage(self) -> Tuple[int, int]:
+        """
+        Keeps storage in budget and reclaims space of removed thumbnails, index is loaded again afterwards
+        @return: number of removed thumbnails and reclaimed bytes
+        """
+        result = self.storage.collect(self.max_size)
+        self._index = None
+        return result
+
+    def get_stats(self) -> dict:
+        index = self._get_index()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': self._size,
+            'max_size': self.max_size,
+            'thumbnails': len(index),
+        }
@@ -0,0 +1,215 @@
+import io
+import flask
+from pathlib import Path
+import eventlet
+from eventlet import tpool
+from eventlet.greenthread import GreenThread
+from eventlet.semaphore import Semaphore
+from logging import getLogger
+from typing import Dict, List, Tuple, Union
+from PIL import Image
+from file_thumbnailer.ConverterManager import ConverterManager
+from file_thumbnailer.models.Dimensions import Dimensions
+from file_thumbnailer.exceptions import NotSupportedException
+from file_thumbnailer.Tools import Tools
+from tux_control.tools.ThumbnailCache import ThumbnailCache
+
+LOG = getLogger(__name__)
+
+
+def detect_mime_type(path: str) -> str:
+    """
+    Detects mime type of file the same way file_thumbnailer does. python-magic guards its handle by lock,
+    which is green after monkey_patch and must not be taken in tpool thread, so it is called from green thread
+    @param path: source file
+    @return:
+    """
+    with open(path, 'rb') as file_handle:
+        return Tools.detect_mimetype(file_handle, Path(path))
+
+
+def render_thumbnails(path: str, sizes: List[str], image_format: str = 'jpeg', quality: int = 85, mime_type: str = None, converter_manager: ConverterManager = None) -> Union[Dict[str, bytes], None]:
+    """
+    Decodes file once and renders all requested sizes from it, runs in worker thread (or Celery worker),
+    decoding may take long and must not block eventlet hub
+    @param path: source file
+    @param sizes: dimensions of thumbnails
+    @param image_format: jpeg or webp
+    @param quality: encoder quality
+    @param mime_type: mime type from detect_mime_type, detected here when not known
+    @param converter_manager: created here when not given, its constructor logs
+    @return: encoded images by their dimensions or None when file is not supported
+    """
+    try:
+        image = (converter_manager or ConverterManager()).from_file(path, mime_type).to_pil_image()
+    except (NotSupportedException, FileNotFoundError):
+        return None
+
+    if image_format == 'jpeg' and image.mode != 'RGB':
+        # JPEG has no alpha, transparent images are flattened onto white background
+        rgba_image = image.convert('RGBA')
+        image = Image.new('RGB', rgba_image.size, (255, 255, 255))
+        image.paste(rgba_image, mask=rgba_image.getchannel('A'))
+
+    targets = {}
+    for dimensions in sizes:
+        width, height = ThumbnailGenerator.parse_dimensions(dimensions)
+        target = Tools.calculate_dimensions(Dimensions(image.width, image.height), Dimensions(width, height))
+        if target.width > image.width or target.height > image.height:
+            # Never upscaled, small image is its own thumbnail for all larger sizes
+            targets[dimensions] = (image.width, image.height)
+        else:
+            targets[dimensions] = (max(target.width, 1), max(target.height, 1))
+
+    # Largest first, every smaller size is downscaled from the previous one instead of from full resolution
+    thumbnails = {}
+    encoded = {}
+    source = image
+    for dimensions, target in sorted(targets.items(), key=lambda item: item[1][0] * item[1][1], reverse=True):
+        if target not in encoded:
+            # Sizes clamped to the same target share one rendition
+            thumbnail = source if target == (source.width, source.height) else source.resize(target, Image.LANCZOS)
+            if target[0] <= source.width and target[1] <= source.height:
+                source = thumbnail
+
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, format=image_format.upper(), quality=quality)
+            encoded[target] = buffer.getvalue()
+
+        thumbnails[dimensions] = encoded[target]
+
+    return thumbnails
+
+
+class ThumbnailGenerator:
+    """
+    Generates thumbnails in real OS threads of eventlet.tpool, so slow decoding never blocks eventlet hub,
+    decoders release GIL while they work. At most `workers` files are decoded at once. Nothing taking green locks
+    (python-magic, logging) may run in tpool thread, it would block the thread on the hub of other thread.
+    Concurrent requests for the same thumbnail share one job (single flight). Every job renders the whole ladder
+    of configured sizes from one decode, so switching views does not decode the file again.
+    """
+    name = 'thumbnail_generator'
+    app = None
+    workers = 2
+    timeout = 60
+    sizes = ('x100', '300x300', '1280x1280')
+    quality = 85
+
+    def __init__(self, app: flask.Flask = None, thumbnail_cache: ThumbnailCache = None):
+        self.thumbnail_cache = None
+        self._in_flight = {}  # type: Dict[Tuple[str, str], GreenThread]
+        self._semaphore = Semaphore(self.workers)
+        self._converter_manager = ConverterManager()
+        if app is not None:
+            self.init_app(app, thumbnail_cache)
+
+    def init_app(self, app: flask.Flask, thumbnail_cache: ThumbnailCache):
+        if not hasattr(app, 'extensions'):
+            app.extensions = dict()
+        if self.name in app.extensions:
+            raise ValueError('Already registered extension {}.'.format(self.name))
+        app.extensions[self.name] = self
+
+        self.app = app
+        self.thumbnail_cache = thumbnail_cache
+        self.workers = app.config.get('THUMBNAIL_WORKERS', self.workers)
+        self._semaphore = Semaphore(self.workers)
+        self.timeout = app.config.get('THUMBNAIL_TIMEOUT', self.timeout)
+        self.sizes = tuple(app.config.get('THUMBNAIL_SIZES', self.sizes))
+        self.quality = app.config.get('THUMBNAIL_QUALITY', self.quality)
+
+    def _render(self, path: str, sizes: List[str]) -> Union[Dict[str, bytes], None]:
+        # Green thread waits for free worker, only the decoding itself runs in OS thread
+        with self._semaphore:
+            try:
+                mime_type = detect_mime_type(path)
+                return tpool.execute(
+                    render_thumbnails,
+                    path,
+                    sizes,
+                    self.thumbnail_cache.image_format,
+                    self.quality,
+                    mime_type,
+                    self._converter_manager
+                )
+            except FileNotFoundError:
+                return None
+            except Exception:
+                LOG.exception('Thumbnail of {} failed'.format(path))
+                return None
+
+    def _submit(self, path: str, sizes: List[str]) -> GreenThread:
+        return eventlet.spawn(self._render, path, sizes)
+
+    def _on_job_done(self, job: GreenThread, job_key: Tuple[str, str]):
+        """
+        Stores result of finished job and forgets the job, runs in the job's green thread before waiters wake up,
+        so result of job outliving timeouts of all its waiters is not lost and the job does not stay in flight
+        @param job: finished job
+        @param job_key: key of the job in _in_flight
+        @return:
+        """
+        if self._in_flight.get(job_key) is job:
+            del self._in_flight[job_key]
+
+        thumbnails = job.wait()
+        if thumbnails:
+            self.thumbnail_cache.put(job_key[0], thumbnails)
+
+    def get_missing_sizes(self, key: str, dimensions: str) -> List[str]:
+        """
+        Returns sizes to render together with requested one, sizes already stored are not rendered again
+        @param key: see ThumbnailCache.get_key
+        @param dimensions: requested dimensions
+        @return:
+        """
+        sizes = list(self.sizes)
+        if dimensions not in sizes:
+            sizes.append(dimensions)
+        return [size for size in sizes if size == dimensions or not self.thumbnail_cache.contains(key, size)]
+
+    @staticmethod
+    def parse_dimensions(dimensions: Union[str, None]) -> Tuple[Union[int, None], Union[int, None]]:
+        if not dimensions:
+            return None, 100
+
+        width, height = [int(part) if part else None for part in dimensions.split('x')]
+        return width, height
+
+    def generate(self, key: str, path: str, dimensions: str) -> Union[bytes, None]:
+        """
+        Returns thumbnail, it is generated when not stored yet, caller waits without blocking other green threads
+        @param key: see ThumbnailCache.get_key
+        @param path: source file
+        @param dimensions: requested dimensions
+        @return: encoded image or None when file is not supported or thumbnail could not be generated in time
+        """
+        thumbnail = self.thumbnail_cache.get(key, dimensions)
+        if thumbnail:
+            return thumbnail
+
+        # Spawning does not switch to other green threads, job is registered before anybody else looks for it
+        job_key = (key, dimensions)
+        job = self._in_flight.get(job_key)
+        if job is None:
+            job = self._submit(path, self.get_missing_sizes(key, dimensions))
+            self._in_flight[job_key] = job
+            job.link(self._on_job_done, job_key)
+
+        timeout = eventlet.Timeout(self.timeout)
+        try:
+            thumbnails = job.wait()
+        except eventlet.Timeout as e:
+            if e is not timeout:
+                raise
+            # Job keeps running, its result is stored when it finishes
+            LOG.warning('Thumbnail of {} was not generated in {} s'.format(path, self.timeout))
+            return None
+        finally:
+            timeout.cancel()
+
+        if thumbnails is None:
+            return None
+
+        return thumbnails.get(dimensions)
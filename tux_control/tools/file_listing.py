@@ -0,0 +1,234 @@
+import os
+import re
+import time
+import heapq
+import fnmatch
+from collections import OrderedDict
+from pathlib import Path
+from typing import Generator, Iterable, List, Union, Tuple
+from tux_control.models.FileInfo import FileInfo
+from tux_control.tools.DirectoryListingCache import DirectoryListingCache
+
+_digits_regex = re.compile(r'(\d+)')
+
+
+def _read_directory(directory: Path, cache: DirectoryListingCache = None) -> Generator[Tuple[str, Union[os.stat_result, None]], None, None]:
+    absolute = str(directory.absolute())
+    if cache:
+        cached_entries = cache.get(absolute)
+        if cached_entries is not None:
+            yield from cached_entries
+            return
+
+        stat_info = os.stat(absolute)
+
+    entries = []
+    with os.scandir(absolute) as dir_entries:
+        for dir_entry in dir_entries:
+            try:
+                entry_stat_info = dir_entry.stat()
+            except OSError:
+                # Broken symlink or entry removed in the meantime
+                entry_stat_info = None
+
+            entry = (dir_entry.name, entry_stat_info)
+            if cache and entries is not None:
+                entries.append(entry)
+                if len(entries) > cache.max_entries:
+                    # Too big to be cached, keep memory flat
+                    entries = None
+            yield entry
+
+    if cache and entries is not None:
+        cache.put(absolute, entries, stat_info)
+
+
+def scan_directory(directory: Path, glob_string: str = '*', resolve_parents: bool = False, cache: DirectoryListingCache = None) -> Generator[FileInfo, None, None]:
+    """
+    Lazily lists allowed files and directories in directory
+    @param directory: directory to list
+    @param glob_string: pattern entry names have to match
+    @param resolve_parents: resolve parents of every yielded FileInfo
+    @param cache: listing cache to use
+    @return:
+    """
+    for name, stat_info in _read_directory(directory, cache):
+        if not fnmatch.fnmatchcase(name, glob_string):
+            continue
+
+        file_info = FileInfo(directory / name, resolve_parents, stat_info)
+        if not file_info.is_allowed_file():
+            continue
+
+        yield file_info
+
+
+def chunked(items: Iterable, chunk_size: int) -> Generator[List, None, None]:
+    """
+    Splits items into lists of at most chunk_size items
+    @param items:
+    @param chunk_size:
+    @return:
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def listing_envelope(directory_info: FileInfo, items: List[FileInfo], **kwargs) -> dict:
+    """
+    Wraps listed items so the listed directory and its parents are serialized only once
+    @param directory_info: listed directory
+    @param items: listed items
+    @param kwargs: additional envelope fields
+    @return:
+    """
+    envelope = {
+        'parent': directory_info,
+        'data': [item.to_dict(False) for item in items],
+    }
+    envelope.update(kwargs)
+    return envelope
+
+
+def _natural_key(name: str) -> tuple:
+    parts = _digits_regex.split(name.casefold())
+    # Split by capturing group keeps digits on odd positions, so compared types always match
+    return tuple(int(part) if index % 2 else part for index, part in enumerate(parts))
+
+
+def _type_key(file_info: FileInfo) -> tuple:
+    return file_info.suffix.casefold(), file_info.name.casefold()
+
+
+SORT_KEYS = {
+    'name': lambda file_info: file_info.name,
+    'name_natural': lambda file_info: _natural_key(file_info.name),
+    'name_insensitive': lambda file_info: file_info.name.casefold(),
+    'created': lambda file_info: file_info.stat_info.st_ctime,
+    'updated': lambda file_info: file_info.stat_info.st_mtime,
+    'size': lambda file_info: file_info.size,
+    'type': _type_key,
+}
+
+
+def sort_file_infos(file_infos: List[FileInfo], sort_field: str = 'name', reverse: bool = False, limit: int = None) -> List[FileInfo]:
+    """
+    Sorts file infos by sort_field, when limit is set only first limit items are selected using heap
+    @param file_infos: items to sort
+    @param sort_field: one of SORT_KEYS
+    @param reverse: sort in descending order
+    @param limit: number of items to return
+    @return:
+    """
+    sort_key = SORT_KEYS[sort_field]
+    # Sort keys are computed once per item, index keeps sort stable and FileInfo out of comparisons
+    decorated = [(sort_key(file_info), -index if reverse else index, file_info) for index, file_info in enumerate(file_infos)]
+
+    if limit is not None and limit < len(decorated):
+        selected = heapq.nlargest(limit, decorated) if reverse else heapq.nsmallest(limit, decorated)
+    else:
+        selected = sorted(decorated, reverse=reverse)
+
+    return [file_info for _, _, file_info in selected]
+
+
+def list_directory(
+        directory: Path,
+        glob_string: str = '*',
+        sort_field: str = 'name',
+        reverse: bool = False,
+        cache: DirectoryListingCache = None,
+        limit: int = None
+) -> Tuple[List[FileInfo], int]:
+    """
+    Lists allowed files and directories in directory sorted by sort_field, directories first
+    @param directory: directory to list
+    @param glob_string: pattern entry names have to match
+    @param sort_field: one of SORT_KEYS
+    @param reverse: sort in descending order
+    @param cache: listing cache to use
+    @param limit: return only first limit items
+    @return: sorted items and total number of items
+    """
+    files = []
+    dirs = []
+    for file_info in scan_directory(directory, glob_string, cache=cache):
+        if file_info.is_dir:
+            dirs.append(file_info)
+        elif file_info.is_file:
+            files.append(file_info)
+
+    total = len(dirs) + len(files)
+    sorted_dirs = sort_file_infos(dirs, sort_field, reverse, limit)
+    files_limit = None if limit is None else max(limit - len(sorted_dirs), 0)
+    sorted_files = sort_file_infos(files, sort_field, reverse, files_limit) if files_limit != 0 else []
+
+    return sorted_dirs + sorted_files, total
+
+
+class ListingSnapshots:
+    """
+    Sorted directory listings kept for a short time, so clients can fetch them window by window.
+    Memory is bounded by total number of entries in all snapshots, keys start with socket.io session id of the owner
+    """
+
+    def __init__(self, max_snapshots: int = 64):
+        self.max_snapshots = max_snapshots
+        self._snapshots = OrderedDict()
+        self._entries = 0
+
+    def get(self, key: tuple, ttl: float) -> Union[List[FileInfo], None]:
+        self._expire(ttl)
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            return None
+
+        self._snapshots.move_to_end(key)
+        _, items = snapshot
+        return items
+
+    def put(self, key: tuple, items: List[FileInfo], ttl: float, max_entries: int) -> None:
+        """
+        Stores snapshot, least recently used snapshots are dropped over limits
+        @param key:
+        @param items: sorted listing
+        @param ttl: seconds snapshot is kept
+        @param max_entries: maximal number of entries in all snapshots, bigger listing is not stored at all
+        @return:
+        """
+        self._expire(ttl)
+        self._remove(key)
+        if len(items) > max_entries:
+            return
+
+        self._snapshots[key] = (time.monotonic(), items)
+        self._entries += len(items)
+        while len(self._snapshots) > self.max_snapshots or self._entries > max_entries:
+            self._remove(next(iter(self._snapshots)))
+
+    def remove_owner(self, sid: str) -> None:
+        """
+        Drops all snapshots of disconnected client
+        @param sid: socket.io session id
+        @return:
+        """
+        for key in [key for key in self._snapshots if key[0] == sid]:
+            self._remove(key)
+
+    def _remove(self, key: tuple) -> None:
+        snapshot = self._snapshots.pop(key, None)
+        if snapshot:
+            self._entries -= len(snapshot[1])
+
+    def _expire(self, ttl: float) -> None:
+        now = time.monotonic()
+        expired = [key for key, (created, _) in self._snapshots.items() if now - created > ttl]
+        for key in expired:
+            self._remove(key)
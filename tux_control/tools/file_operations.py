@@ -0,0 +1,242 @@
+import os
+import stat
+import errno
+import shutil
+from typing import Callable, List, Union
+
+BLOCK_SIZE = 8 * 1024 * 1024
+
+ProgressCallback = Callable[[int], None]
+
+
+def _noop_progress(copied: int) -> None:
+    pass
+
+
+def _kernel_copy(source_fd: int, destination_fd: int, on_progress: ProgressCallback) -> None:
+    """
+    Copies data between file descriptors without passing them through userspace,
+    copy_file_range is tried first (allows reflinks and server side copies), then sendfile and plain read/write
+    """
+    use_copy_file_range = hasattr(os, 'copy_file_range')
+    use_sendfile = True
+    copied_total = 0
+    while True:
+        try:
+            if use_copy_file_range:
+                copied = os.copy_file_range(source_fd, destination_fd, BLOCK_SIZE)
+            elif use_sendfile:
+                copied = os.sendfile(destination_fd, source_fd, None, BLOCK_SIZE)
+            else:
+                data = os.read(source_fd, BLOCK_SIZE)
+                copied = os.write(destination_fd, data) if data else 0
+        except OSError as e:
+            # Offsets are shared by all methods, so it is safe to switch method in the middle of copy
+            if use_copy_file_range and e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM):
+                use_copy_file_range = False
+                continue
+            if use_sendfile and e.errno in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP) and not copied_total:
+                use_sendfile = False
+                continue
+            raise
+
+        if not copied:
+            return
+
+        copied_total += copied
+        on_progress(copied)
+
+
+def copy_file(source: str, destination: str, on_progress: ProgressCallback = None, uid: int = None, gid: int = None, source_dir_fd: int = None, destination_dir_fd: int = None) -> bool:
+    """
+    Copies content and metadata of regular file, destination must not exist. Copies run as root, so source is opened
+    without following symlinks and without blocking on FIFO and everything is checked on the opened file
+    @param source: path or name in source_dir_fd
+    @param destination: path or name in destination_dir_fd
+    @param on_progress: called with number of bytes copied by each step
+    @param uid: owner of created file, source must be readable by this user
+    @param gid: group of created file
+    @param source_dir_fd: directory source is in
+    @param destination_dir_fd: directory destination is created in
+    @return: False when source is not a regular file readable by the user, nothing is copied then
+    """
+    try:
+        source_fd = os.open(source, os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK, dir_fd=source_dir_fd)
+    except OSError as e:
+        if e.errno == errno.ELOOP:
+            # Swapped for symlink meanwhile
+            return False
+        raise
+
+    try:
+        stat_info = os.fstat(source_fd)
+        if not stat.S_ISREG(stat_info.st_mode) or (uid is not None and not is_readable_by(stat_info, uid, gid)):
+            return False
+
+        destination_fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600, dir_fd=destination_dir_fd)
+        try:
+            _kernel_copy(source_fd, destination_fd, on_progress or _noop_progress)
+            _copy_metadata(stat_info, destination_fd, uid, gid)
+        finally:
+            os.close(destination_fd)
+    finally:
+        os.close(source_fd)
+
+    return True
+
+
+def _copy_metadata(stat_info: os.stat_result, destination_fd: int, uid: int = None, gid: int = None) -> None:
+    if uid is not None:
+        os.fchown(destination_fd, uid, gid)
+    os.fchmod(destination_fd, stat.S_IMODE(stat_info.st_mode))
+    os.utime(destination_fd, ns=(stat_info.st_atime_ns, stat_info.st_mtime_ns))
+
+
+def is_readable_by(stat_info: os.stat_result, uid: int, gid: int) -> bool:
+    """
+    Checks whether user could read file (and list directory) without root, copies run as root
+    @param stat_info: stat of file
+    @param uid:
+    @param gid: primary group of user
+    @return:
+    """
+    if stat.S_ISLNK(stat_info.st_mode):
+        return True
+
+    mode = stat_info.st_mode
+    if stat_info.st_uid == uid:
+        read, execute = stat.S_IRUSR, stat.S_IXUSR
+    elif stat_info.st_gid == gid:
+        read, execute = stat.S_IRGRP, stat.S_IXGRP
+    else:
+        read, execute = stat.S_IROTH, stat.S_IXOTH
+
+    if stat.S_ISDIR(mode):
+        return bool(mode & read) and bool(mode & execute)
+
+    return bool(mode & read)
+
+
+def copy(source: str, destination: str, uid: int = None, gid: int = None, on_progress: ProgressCallback = None) -> List[str]:
+    """
+    Copies file, symlink or whole directory tree, destination must not exist.
+    When uid is set, entries of the tree the user can not read are skipped. Tree is walked by file descriptors
+    without following symlinks, so the user can not swap any part of source or destination meanwhile
+    @param source:
+    @param destination:
+    @param uid: owner of created files
+    @param gid: group of created files
+    @param on_progress: called with number of bytes copied by each step
+    @return: absolute paths of skipped entries, they are not readable by the user or not regular files (e.g. FIFO)
+    """
+    skipped = []
+    source_dir_fd = os.open(os.path.dirname(source), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        destination_dir_fd = os.open(os.path.dirname(destination), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            _copy_entry(
+                source,
+                source_dir_fd,
+                destination_dir_fd,
+                os.path.basename(source),
+                os.path.basename(destination),
+                uid,
+                gid,
+                on_progress or _noop_progress,
+                skipped
+            )
+        finally:
+            os.close(destination_dir_fd)
+    finally:
+        os.close(source_dir_fd)
+
+    return skipped
+
+
+def _copy_entry(source: str, source_dir_fd: int, destination_dir_fd: int, source_name: str, destination_name: str, uid: Union[int, None], gid: Union[int, None], on_progress: ProgressCallback, skipped: List[str]) -> None:
+    stat_info = os.stat(source_name, dir_fd=source_dir_fd, follow_symlinks=False)
+    if stat.S_ISLNK(stat_info.st_mode):
+        os.symlink(os.readlink(source_name, dir_fd=source_dir_fd), destination_name, dir_fd=destination_dir_fd)
+        if uid is not None:
+            os.chown(destination_name, uid, gid, dir_fd=destination_dir_fd, follow_symlinks=False)
+        return
+
+    if stat.S_ISREG(stat_info.st_mode):
+        if not copy_file(source_name, destination_name, on_progress, uid, gid, source_dir_fd, destination_dir_fd):
+            skipped.append(source)
+        return
+
+    if not stat.S_ISDIR(stat_info.st_mode):
+        # Devices, FIFOs and sockets are never opened
+        skipped.append(source)
+        return
+
+    try:
+        source_fd = os.open(source_name, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=source_dir_fd)
+    except OSError as e:
+        if e.errno in (errno.ELOOP, errno.ENOTDIR):
+            # Swapped for symlink or file meanwhile
+            skipped.append(source)
+            return
+        raise
+
+    try:
+        stat_info = os.fstat(source_fd)
+        if uid is not None and not is_readable_by(stat_info, uid, gid):
+            skipped.append(source)
+            return
+
+        os.mkdir(destination_name, 0o700, dir_fd=destination_dir_fd)
+        destination_fd = os.open(destination_name, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=destination_dir_fd)
+        try:
+            with os.scandir(source_fd) as entries:
+                names = [entry.name for entry in entries]
+
+            for name in names:
+                _copy_entry(os.path.join(source, name), source_fd, destination_fd, name, name, uid, gid, on_progress, skipped)
+
+            _copy_metadata(stat_info, destination_fd, uid, gid)
+        finally:
+            os.close(destination_fd)
+    finally:
+        os.close(source_fd)
+
+
+def move(source: str, destination: str, uid: int = None, gid: int = None, on_progress: ProgressCallback = None) -> None:
+    """
+    Moves file or directory tree, rename is used when possible, destination must not exist
+    @param source:
+    @param destination:
+    @param uid: owner of files created when moving across filesystems
+    @param gid: group of files created when moving across filesystems
+    @param on_progress: called with number of bytes copied by each step
+    @return:
+    """
+    if os.path.lexists(destination):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), destination)
+
+    try:
+        os.rename(source, destination)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    skipped = copy(source, destination, uid, gid, on_progress)
+    if skipped:
+        # Source is kept, it would be lost with entries that were not copied
+        raise PermissionError(errno.EACCES, 'Permission denied to {} entries, source was not removed'.format(len(skipped)), skipped[0])
+
+    delete(source)
+
+
+def delete(path: str) -> None:
+    """
+    Deletes file, symlink or whole directory tree
+    @param path:
+    @return:
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.unlink(path)
@@ -0,0 +1,180 @@
+import os
+import uuid
+import datetime
+import flask
+from typing import List, Tuple, Union, Callable
+from werkzeug.http import parse_range_header, parse_if_range_header, is_resource_modified
+from tux_control.models.FileInfo import FileInfo
+
+BLOCK_SIZE = 64 * 1024
+MAX_RANGES = 16
+
+
+def get_etag(path_info: FileInfo) -> str:
+    """
+    Strong validator of file content, any write changes mtime and rename to the path changes inode
+    @param path_info:
+    @return:
+    """
+    stat_info = path_info.stat_info
+    return '{:x}-{:x}-{:x}'.format(stat_info.st_ino, stat_info.st_size, stat_info.st_mtime_ns)
+
+
+def get_last_modified(path_info: FileInfo) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(int(path_info.stat_info.st_mtime), datetime.timezone.utc)
+
+
+def set_private_cache(response: flask.Response, max_age: int = 0) -> flask.Response:
+    """
+    Files are authorized by JWT in query string, so responses may be stored only by browser of the user, never by shared caches
+    @param response:
+    @param max_age: seconds response is fresh without revalidation, 0 means revalidate every time
+    @return:
+    """
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if max_age:
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+        response.cache_control.max_age = None
+    response.headers.pop('Expires', None)
+    return response
+
+
+def not_modified_response(etag: str, last_modified: datetime.datetime, max_age: int = 0) -> Union[flask.Response, None]:
+    """
+    Answers conditional request without touching the content
+    @param etag:
+    @param last_modified:
+    @param max_age: see set_private_cache
+    @return: 304 response or None when client has no fresh copy
+    """
+    if is_resource_modified(flask.request.environ, etag, last_modified=last_modified):
+        return None
+
+    response = flask.Response(status=304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return set_private_cache(response, max_age)
+
+
+def _normalize_ranges(ranges: List[Tuple[int, int]], file_size: int) -> List[Tuple[int, int]]:
+    """
+    Converts parsed ranges to absolute (start, stop) pairs, stop is exclusive, unsatisfiable ranges are dropped
+    """
+    normalized = []
+    for start, stop in ranges:
+        if start < 0:
+            start = max(file_size + start, 0)
+            stop = file_size
+        else:
+            stop = file_size if stop is None else min(stop, file_size)
+
+        if start < stop:
+            normalized.append((start, stop))
+
+    return normalized
+
+
+def _is_if_range_fresh(etag: str, last_modified: datetime.datetime) -> bool:
+    if_range_raw = flask.request.headers.get('If-Range')
+    if not if_range_raw:
+        return True
+
+    if_range = parse_if_range_header(if_range_raw)
+    if if_range.etag is not None:
+        return if_range.etag == etag
+
+    return if_range.date is not None and if_range.date == last_modified
+
+
+def _read_ranges(file_handle, ranges: List[Tuple[int, int]], part_headers: List[bytes], closing: bytes):
+    file_descriptor = file_handle.fileno()
+    for (start, stop), part_header in zip(ranges, part_headers):
+        yield part_header
+        while start < stop:
+            data = os.pread(file_descriptor, min(BLOCK_SIZE, stop - start), start)
+            if not data:
+                # File was truncated while being sent
+                return
+            start += len(data)
+            yield data
+    yield closing
+
+
+def _multipart_response(path_info: FileInfo, mimetype: str, ranges: List[Tuple[int, int]]) -> flask.Response:
+    file_size = path_info.size
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        '\r\n--{}\r\nContent-Type: {}\r\nContent-Range: bytes {}-{}/{}\r\n\r\n'.format(
+            boundary, mimetype, start, stop - 1, file_size
+        ).encode('ascii')
+        for start, stop in ranges
+    ]
+    closing = '\r\n--{}--\r\n'.format(boundary).encode('ascii')
+    content_length = sum(len(part_header) for part_header in part_headers) + sum(stop - start for start, stop in ranges) + len(closing)
+
+    file_handle = open(path_info.absolute, 'rb')
+    response = flask.Response(
+        _read_ranges(file_handle, ranges, part_headers, closing),
+        206,
+        mimetype='multipart/byteranges; boundary={}'.format(boundary),
+        direct_passthrough=True,
+    )
+    # Generator is never started for HEAD requests, so file must be closed with response
+    response.call_on_close(file_handle.close)
+    response.headers['Content-Length'] = content_length
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def send_file_partial(path_info: FileInfo, mimetype: Union[str, Callable[[], str]], as_attachment: bool = False, max_age: int = 0) -> flask.Response:
+    """
+    Sends file with support of conditional and range requests, body is streamed from file in constant memory.
+    Single range requests (including open ended and suffix ranges) and HEAD are handled by send_file,
+    multiple ranges are sent as multipart/byteranges
+    @param path_info: sent file
+    @param mimetype: mime type or callable returning it, callable is not called when client has fresh copy
+    @param as_attachment: send Content-Disposition: attachment
+    @param max_age: see set_private_cache
+    @return:
+    """
+    etag = get_etag(path_info)
+    last_modified = get_last_modified(path_info)
+
+    # Revalidation must not pay for reading the content (libmagic)
+    not_modified = not_modified_response(etag, last_modified, max_age)
+    if not_modified:
+        return not_modified
+
+    if callable(mimetype):
+        mimetype = mimetype()
+
+    parsed_range = parse_range_header(flask.request.headers.get('Range'))
+    if parsed_range and len(parsed_range.ranges) > 1:
+        if len(parsed_range.ranges) > MAX_RANGES or not _is_if_range_fresh(etag, last_modified):
+            # send_file understands only single range, let it answer with whole file,
+            # too many small ranges are cheaper to send as whole file anyway
+            flask.request.environ.pop('HTTP_RANGE', None)
+        else:
+            ranges = _normalize_ranges(parsed_range.ranges, path_info.size)
+            if not ranges:
+                response = flask.Response(status=416)
+                response.headers['Content-Range'] = 'bytes */{}'.format(path_info.size)
+                return response
+
+            response = _multipart_response(path_info, mimetype, ranges)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            return set_private_cache(response, max_age)
+
+    return set_private_cache(flask.send_file(
+        path_info.absolute,
+        mimetype,
+        as_attachment=as_attachment,
+        download_name=path_info.name,
+        etag=etag,
+        last_modified=last_modified,
+    ), max_age)
@@ -0,0 +1,119 @@
+import os
+import errno
+import struct
+import ctypes
+import ctypes.util
+from typing import List, NamedTuple
+
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+# Any change of directory content
+IN_DIRECTORY_CHANGES = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_DELETE_SELF | IN_MOVE_SELF
+
+_event_header = struct.Struct('iIII')
+_libc = None
+
+
+class InotifyEvent(NamedTuple):
+    wd: int
+    mask: int
+    cookie: int
+    name: str
+
+
+def _get_libc() -> ctypes.CDLL:
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc.read.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t]
+        _libc.read.restype = ctypes.c_ssize_t
+    return _libc
+
+
+def _raise_errno() -> None:
+    error_number = ctypes.get_errno()
+    raise OSError(error_number, os.strerror(error_number))
+
+
+class Inotify:
+    """
+    Minimal inotify(7) binding, events are read without blocking so it can be drained on demand
+    """
+
+    def __init__(self):
+        libc = _get_libc()
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            _raise_errno()
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def add_watch(self, path: str, mask: int = IN_DIRECTORY_CHANGES) -> int:
+        wd = _get_libc().inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            _raise_errno()
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        if _get_libc().inotify_rm_watch(self.fd, wd) < 0:
+            # Watch is already gone when watched directory was removed
+            if ctypes.get_errno() != errno.EINVAL:
+                _raise_errno()
+
+    def read_events(self) -> List[InotifyEvent]:
+        """
+        Returns all pending events, empty list when there are none
+        @return:
+        """
+        events = []
+        libc = _get_libc()
+        buffer = ctypes.create_string_buffer(64 * 1024)
+        while True:
+            # libc read is used directly, os.read may be replaced by cooperative version waiting for data
+            length = libc.read(self.fd, buffer, len(buffer))
+            if length < 0:
+                if ctypes.get_errno() in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return events
+                _raise_errno()
+
+            data = buffer.raw[:length]
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, name_length = _event_header.unpack_from(data, offset)
+                offset += _event_header.size
+                name = os.fsdecode(data[offset:offset + name_length].rstrip(b'\0'))
+                offset += name_length
+                events.append(InotifyEvent(wd, mask, cookie, name))
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def is_supported() -> bool:
+    try:
+        Inotify().close()
+        return True
+    except (OSError, AttributeError):
+        return False
@@ -0,0 +1,66 @@
+import os
+import uuid
+from typing import Dict, Iterable, Iterator, Tuple, Union
+from tux_control.tools.helpers import mkdir_p
+from tux_control.tools.thumbnails import evict_thumbnails
+from tux_control.tools.thumbnail_storage.IThumbnailStorage import IThumbnailStorage
+
+
+class FileThumbnailStorage(IThumbnailStorage):
+    """
+    Every thumbnail is a file, recency is taken from its access time
+    """
+    def __init__(self, directory: str, extension: str):
+        self.directory = directory
+        self.extension = extension
+
+    def get_path(self, key: str, dimensions: str) -> str:
+        return os.path.join(self.directory, key[:2], '{}_{}.{}'.format(key, dimensions, self.extension))
+
+    def load(self) -> Iterator[Tuple[str, str, int, float]]:
+        mkdir_p(self.directory)
+        for root, directories, files in os.walk(self.directory):
+            for file_name in files:
+                name, extension = os.path.splitext(file_name)
+                key, _, dimensions = name.partition('_')
+                if extension != '.{}'.format(self.extension) or len(key) != 40 or not dimensions:
+                    # Temporary files and thumbnails stored under former naming are left to collect
+                    continue
+                try:
+                    stat_info = os.stat(os.path.join(root, file_name))
+                except FileNotFoundError:
+                    continue
+                yield key, dimensions, stat_info.st_size, stat_info.st_atime
+
+    def read(self, key: str, dimensions: str) -> Union[bytes, None]:
+        try:
+            with open(self.get_path(key, dimensions), 'rb') as thumbnail_file:
+                return thumbnail_file.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, key: str, thumbnails: Dict[str, bytes]) -> bool:
+        for dimensions, thumbnail in thumbnails.items():
+            path = self.get_path(key, dimensions)
+            mkdir_p(os.path.dirname(path))
+
+            # Written under temporary name, readers never see incomplete thumbnail
+            tmp_path = '{}.{}'.format(path, uuid.uuid4().hex)
+            with open(tmp_path, 'wb') as f:
+                f.write(thumbnail)
+            os.replace(tmp_path, path)
+
+        return True
+
+    def remove(self, key: str, dimensions: Iterable[str]) -> None:
+        for dimension in dimensions:
+            try:
+                os.remove(self.get_path(key, dimension))
+            except FileNotFoundError:
+                pass
+
+    def collect(self, budget: int) -> Tuple[int, int]:
+        if not os.path.isdir(self.directory):
+            return 0, 0
+
+        return evict_thumbnails(self.directory, budget)
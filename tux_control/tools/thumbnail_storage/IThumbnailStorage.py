@@ -0,0 +1,42 @@
+from typing import Dict, Iterable, Iterator, Tuple, Union
+
+
+class IThumbnailStorage:
+    """
+    Backend storing encoded thumbnails, thumbnail is identified by key of its source file and its dimensions
+    """
+    def load(self) -> Iterator[Tuple[str, str, int, float]]:
+        """
+        Lists stored thumbnails
+        @return: key, dimensions, size and recency (higher is more recent) of every stored thumbnail
+        """
+        raise NotImplementedError
+
+    def read(self, key: str, dimensions: str) -> Union[bytes, None]:
+        """
+        Reads thumbnail, it may be stored or removed by other process, read thumbnail is the most recently used one
+        @param key:
+        @param dimensions:
+        @return: encoded image or None when it is not stored
+        """
+        raise NotImplementedError
+
+    def write(self, key: str, thumbnails: Dict[str, bytes]) -> bool:
+        """
+        Stores thumbnails of one file
+        @param key:
+        @param thumbnails: encoded images by their dimensions
+        @return: False when thumbnails could not be stored now
+        """
+        raise NotImplementedError
+
+    def remove(self, key: str, dimensions: Iterable[str]) -> None:
+        raise NotImplementedError
+
+    def collect(self, budget: int) -> Tuple[int, int]:
+        """
+        Keeps storage in its budget and reclaims space of removed thumbnails, runs periodically in Celery worker
+        @param budget: maximal size of stored thumbnails in bytes
+        @return: number of removed thumbnails and reclaimed bytes
+        """
+        raise NotImplementedError
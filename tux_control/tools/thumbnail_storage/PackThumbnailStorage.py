@@ -0,0 +1,315 @@
+import os
+import time
+import uuid
+import zlib
+import fcntl
+import shutil
+import struct
+from collections import OrderedDict
+from logging import getLogger
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+from tux_control.tools.helpers import mkdir_p
+from tux_control.tools.thumbnail_storage.IThumbnailStorage import IThumbnailStorage
+
+LOG = getLogger(__name__)
+
+BLOCK_SIZE = 64 * 1024
+
+# Record type, length of dimensions, key, length of data and its CRC32, followed by dimensions and data
+RECORD = struct.Struct('<BB40sII')
+RECORD_PUT = 1
+RECORD_REMOVE = 2
+RECORD_ACCESS = 3
+MAX_DIMENSIONS_LENGTH = 255
+
+
+class PackThumbnailStorage(IThumbnailStorage):
+    """
+    All thumbnails are records appended to one pack file, so they take neither inode nor filesystem block each.
+    Offsets of records are indexed in memory, thumbnail is read by single pread. Removal appends tombstone record,
+    space of removed and replaced thumbnails is reclaimed by compaction which rewrites the pack with live records only.
+    Writers append under exclusive lock of separate lock file and first index records appended by other processes,
+    readers never lock, records do not change once written and compaction replaces the pack atomically.
+    Reads are batched into access records appended with next write or after access_interval, so every process
+    (e.g. Celery worker collecting garbage) knows least recently used thumbnails, compaction keeps them in that order.
+    """
+    lock_timeout = 5
+    compaction_ratio = 0.25
+    access_interval = 60
+
+    def __init__(self, directory: str, extension: str):
+        self.directory = directory
+        self.path = os.path.join(directory, 'thumbnails.{}.pack'.format(extension))
+        self.lock_path = os.path.join(directory, 'thumbnails.lock')
+        self._fd = None
+        self._inode = None
+        self._end = 0
+        # Key -> dimensions -> (data offset, data length, CRC32, record length), least recently used first
+        self._index = OrderedDict()
+        self._live_size = 0
+        self._live_records_size = 0
+        # Keys read since access records were appended last time
+        self._accessed = OrderedDict()
+        self._accessed_since = time.monotonic()
+
+    def _open(self) -> None:
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            inode = None
+
+        if self._fd is not None and inode == self._inode:
+            return
+
+        # Pack was compacted by other process, open file descriptor still refers to the old one
+        if self._fd is not None:
+            os.close(self._fd)
+
+        mkdir_p(self.directory)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._inode = os.fstat(self._fd).st_ino
+        self._end = 0
+        self._index = OrderedDict()
+        self._live_size = 0
+        self._live_records_size = 0
+
+    def _scan(self) -> None:
+        # Indexes records appended since last scan, stops at torn record left by crashed writer
+        file_size = os.fstat(self._fd).st_size
+        offset = self._end
+        while offset + RECORD.size <= file_size:
+            chunk = os.pread(self._fd, RECORD.size + MAX_DIMENSIONS_LENGTH, offset)
+            if len(chunk) < RECORD.size:
+                break
+
+            record_type, dimensions_length, key, length, crc = RECORD.unpack_from(chunk)
+            data_offset = offset + RECORD.size + dimensions_length
+            end = data_offset + length
+            if record_type not in (RECORD_PUT, RECORD_REMOVE, RECORD_ACCESS) or end > file_size or len(chunk) < RECORD.size + dimensions_length:
+                break
+
+            key = key.decode('ascii', 'replace')
+            if record_type == RECORD_PUT:
+                dimensions = chunk[RECORD.size:RECORD.size + dimensions_length].decode('ascii', 'replace')
+                self._add(key, dimensions, (data_offset, length, crc, end - offset))
+            elif record_type == RECORD_REMOVE:
+                self._drop(key)
+            else:
+                self._touch(key)
+            offset = end
+
+        self._end = offset
+
+    def _sync(self) -> None:
+        self._open()
+        self._scan()
+
+    def _add(self, key: str, dimensions: str, location: Tuple[int, int, int, int]) -> None:
+        sizes = self._index.setdefault(key, {})
+        previous = sizes.get(dimensions)
+        if previous:
+            self._live_size -= previous[1]
+            self._live_records_size -= previous[3]
+        sizes[dimensions] = location
+        self._index.move_to_end(key)
+        self._live_size += location[1]
+        self._live_records_size += location[3]
+
+    def _touch(self, key: str) -> None:
+        if key in self._index:
+            self._index.move_to_end(key)
+
+    def _drop(self, key: str) -> None:
+        for _, length, _, record_length in self._index.pop(key, {}).values():
+            self._live_size -= length
+            self._live_records_size -= record_length
+
+    def _lock(self, timeout: float = None) -> Union[int, None]:
+        # Own open file description for every lock, so flock excludes also other threads of this process
+        mkdir_p(self.directory)
+        lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        deadline = time.monotonic() + (self.lock_timeout if timeout is None else timeout)
+        while True:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_fd
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    os.close(lock_fd)
+                    return None
+                # Green sleep under eventlet, other requests are served meanwhile
+                time.sleep(0.01)
+
+    @staticmethod
+    def _unlock(lock_fd: int) -> None:
+        fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        os.close(lock_fd)
+
+    @staticmethod
+    def _write_all(fd: int, data: bytes, offset: int) -> None:
+        written = 0
+        while written < len(data):
+            written += os.pwrite(fd, data[written:], offset + written)
+
+    @staticmethod
+    def _copy(from_fd: int, from_offset: int, length: int, to_fd: int, to_offset: int) -> None:
+        copied = 0
+        while copied < length:
+            block = os.pread(from_fd, min(BLOCK_SIZE, length - copied), from_offset + copied)
+            if not block:
+                raise IOError('Pack was truncated while copied')
+            PackThumbnailStorage._write_all(to_fd, block, to_offset + copied)
+            copied += len(block)
+
+    def _append(self, records: List[Tuple[int, str, str, bytes]], lock_timeout: float = None) -> bool:
+        lock_fd = self._lock(lock_timeout)
+        if lock_fd is None:
+            if records:
+                LOG.warning('Thumbnail pack is locked for more than {} s, thumbnails are not stored'.format(self.lock_timeout))
+            return False
+
+        # Pending accesses go first, records written now are more recent
+        accessed = list(self._accessed)
+        records = [(RECORD_ACCESS, key, '', b'') for key in accessed] + records
+
+        try:
+            self._sync()
+            if os.fstat(self._fd).st_size > self._end:
+                # Torn record left by crashed writer
+                os.ftruncate(self._fd, self._end)
+
+            # All records are written at once, all sizes of one file are next to each other
+            data = bytearray()
+            locations = []
+            for record_type, key, dimensions, thumbnail in records:
+                dimensions_bytes = dimensions.encode('ascii')
+                crc = zlib.crc32(thumbnail)
+                data_offset = self._end + len(data) + RECORD.size + len(dimensions_bytes)
+                record = RECORD.pack(record_type, len(dimensions_bytes), key.encode('ascii'), len(thumbnail), crc) + dimensions_bytes + thumbnail
+                locations.append((data_offset, len(thumbnail), crc, len(record)))
+                data += record
+
+            self._write_all(self._fd, bytes(data), self._end)
+            self._end += len(data)
+            for (record_type, key, dimensions, _), location in zip(records, locations):
+                if record_type == RECORD_PUT:
+                    self._add(key, dimensions, location)
+                elif record_type == RECORD_REMOVE:
+                    self._drop(key)
+                else:
+                    self._touch(key)
+        finally:
+            self._unlock(lock_fd)
+
+        for key in accessed:
+            self._accessed.pop(key, None)
+        self._accessed_since = time.monotonic()
+        return True
+
+    def load(self) -> Iterator[Tuple[str, str, int, float]]:
+        self._sync()
+        for recency, (key, sizes) in enumerate(list(self._index.items())):
+            for dimensions, (_, length, _, _) in sizes.items():
+                yield key, dimensions, length, recency
+
+    def read(self, key: str, dimensions: str) -> Union[bytes, None]:
+        self._open()
+        if os.fstat(self._fd).st_size > self._end:
+            # Other processes appended thumbnails or tombstones of thumbnails indexed here
+            self._scan()
+
+        location = self._index.get(key, {}).get(dimensions)
+        if location is None:
+            return None
+
+        offset, length, crc, _ = location
+        thumbnail = os.pread(self._fd, length, offset)
+        if len(thumbnail) != length or zlib.crc32(thumbnail) != crc:
+            LOG.warning('Thumbnail {} {} in pack is damaged'.format(key, dimensions))
+            return None
+
+        self._index.move_to_end(key)
+        self._accessed.pop(key, None)
+        self._accessed[key] = None
+        if time.monotonic() - self._accessed_since > self.access_interval:
+            # Read does not wait for lock, accesses are appended next time
+            self._append([], lock_timeout=0)
+
+        return thumbnail
+
+    def write(self, key: str, thumbnails: Dict[str, bytes]) -> bool:
+        return self._append([(RECORD_PUT, key, dimensions, thumbnail) for dimensions, thumbnail in thumbnails.items()])
+
+    def remove(self, key: str, dimensions: Iterable[str]) -> None:
+        # Tombstone removes all sizes
+        self._append([(RECORD_REMOVE, key, '', b'')])
+
+    def collect(self, budget: int) -> Tuple[int, int]:
+        # Thumbnails left there by files storage
+        if os.path.isdir(self.directory):
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+
+        self._sync()
+        removed = 0
+        excess = self._live_size - budget
+        evicted = []
+        for key, sizes in self._index.items():
+            if excess <= 0:
+                break
+            evicted.append((RECORD_REMOVE, key, '', b''))
+            removed += len(sizes)
+            excess -= sum(length for _, length, _, _ in sizes.values())
+
+        if evicted and not self._append(evicted):
+            return 0, 0
+
+        reclaimed = 0
+        if self._end - self._live_records_size > self._end * self.compaction_ratio:
+            reclaimed = self._compact()
+
+        return removed, reclaimed
+
+    def _compact(self) -> int:
+        """
+        Rewrites pack with live records only
+        @return: reclaimed bytes
+        """
+        original_size = self._end
+        original_inode = self._inode
+        tmp_path = '{}.{}'.format(self.path, uuid.uuid4().hex)
+        tmp_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            # Live records are copied without lock, records never change once written
+            offset = 0
+            for sizes in list(self._index.values()):
+                for data_offset, length, _, record_length in sizes.values():
+                    self._copy(self._fd, data_offset + length - record_length, record_length, tmp_fd, offset)
+                    offset += record_length
+
+            lock_fd = self._lock()
+            if lock_fd is None:
+                return 0
+
+            try:
+                self._open()
+                if self._inode != original_inode:
+                    # Compacted by other process meanwhile
+                    return 0
+
+                # Records appended meanwhile, thumbnails and tombstones alike, are copied as they are
+                self._scan()
+                self._copy(self._fd, original_size, self._end - original_size, tmp_fd, offset)
+                os.fsync(tmp_fd)
+                os.replace(tmp_path, self.path)
+            finally:
+                self._unlock(lock_fd)
+        finally:
+            os.close(tmp_fd)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self._sync()
+        return max(original_size - self._end, 0)
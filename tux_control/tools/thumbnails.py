@@ -0,0 +1,67 @@
+import os
+import re
+from typing import Tuple
+from tux_control.models.FileInfo import FileInfo
+from tux_control.tools.file_response import get_etag
+
+dimensions_regex = re.compile(r'^(\d*x\d+|\d+x\d*)$')
+
+DEFAULT_DIMENSIONS = 'x100'
+
+# Types file_thumbnailer has converter for, others are never thumbnailed
+PREVIEWABLE_MIME_PREFIXES = ('image/', 'application/pdf')
+
+
+def is_previewable(file_info: FileInfo) -> bool:
+    """
+    Guess whether thumbnail of file can be generated, from its name only so it is cheap for whole directory
+    @param file_info:
+    @return:
+    """
+    return file_info.is_file and file_info.mime_type.startswith(PREVIEWABLE_MIME_PREFIXES)
+
+
+def get_thumbnail_etag(file_info: FileInfo, dimensions: str = None) -> str:
+    # Thumbnail changes only with its source file
+    return '{}-{}'.format(get_etag(file_info), dimensions or DEFAULT_DIMENSIONS)
+
+
+def evict_thumbnails(thumbnails_directory: str, budget: int) -> Tuple[int, int]:
+    """
+    Deletes least recently used thumbnails until the store fits into budget. Recency is taken from access time,
+    with relatime it is updated at most once a day which is good enough to tell browsed and forgotten thumbnails apart
+    @param thumbnails_directory: thumbnail store
+    @param budget: maximal size of thumbnail store in bytes
+    @return: number of removed thumbnails and reclaimed bytes
+    """
+    thumbnails = []
+    total_size = 0
+    for root, directories, files in os.walk(thumbnails_directory):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            try:
+                stat_info = os.stat(path)
+            except FileNotFoundError:
+                continue
+            thumbnails.append((stat_info.st_atime, stat_info.st_size, path))
+            total_size += stat_info.st_size
+
+    removed = 0
+    reclaimed = 0
+    if total_size <= budget:
+        return removed, reclaimed
+
+    thumbnails.sort()
+    for _, size, path in thumbnails:
+        if total_size - reclaimed <= budget:
+            break
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+
+        removed += 1
+        reclaimed += size
+
+    return removed, reclaimed
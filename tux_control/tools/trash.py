@@ -0,0 +1,332 @@
+"""
+Trash following freedesktop.org trash specification, items are moved to trash of the filesystem they are on,
+so deleting is always a single rename
+"""
+import os
+import stat
+import time
+import errno
+import datetime
+import configparser
+import urllib.parse
+from pathlib import Path
+from typing import Tuple, Union
+from tux_control.models.FileInfo import FileInfo
+from tux_control.tools.pam import SystemUser
+
+
+def _get_mount_point(path: str) -> str:
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def _get_home_trash(system_user: SystemUser) -> str:
+    return os.path.join(system_user.home_directory, '.local', 'share', 'Trash')
+
+
+def _open_directory(name: str, system_user: SystemUser, dir_fd: int, create: bool = False) -> int:
+    """
+    Opens directory of trash without following symlinks, it must be owned by system_user
+    @param name: name of directory in directory dir_fd
+    @param system_user: owner of trash
+    @param dir_fd: parent directory
+    @param create: creates directory owned by system_user when it does not exist
+    @return: file descriptor of directory
+    """
+    created = False
+    if create:
+        try:
+            os.mkdir(name, 0o700, dir_fd=dir_fd)
+            created = True
+        except FileExistsError:
+            pass
+
+    # Symlink fails with ELOOP
+    directory_fd = os.open(name, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=dir_fd)
+    try:
+        if created:
+            os.fchown(directory_fd, system_user.id, system_user.group_id)
+        if os.fstat(directory_fd).st_uid != system_user.id:
+            raise PermissionError(errno.EPERM, 'Trash directory is not owned by {}'.format(system_user.username), name)
+    except Exception:
+        os.close(directory_fd)
+        raise
+
+    return directory_fd
+
+
+def _open_trash(trash_directory: str, system_user: SystemUser, create: bool = False) -> Tuple[int, int]:
+    """
+    Opens files and info directories of trash. Trash is in directory of the user, who may replace any part of it
+    by symlink pointing this process elsewhere, so all of it is opened without following symlinks and every
+    rename and unlink in trash is done relative to these file descriptors
+    @param trash_directory:
+    @param system_user: owner of trash
+    @param create: creates missing directories of trash
+    @return: file descriptors of files and info directories
+    """
+    trash_directory = os.path.normpath(trash_directory)
+    if trash_directory == _get_home_trash(system_user):
+        base_directory, components = system_user.home_directory, ('.local', 'share', 'Trash')
+    else:
+        base_directory, components = os.path.dirname(trash_directory), (os.path.basename(trash_directory),)
+
+    directory_fd = os.open(base_directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        for component in components:
+            component_fd = _open_directory(component, system_user, directory_fd, create)
+            os.close(directory_fd)
+            directory_fd = component_fd
+
+        files_fd = _open_directory('files', system_user, directory_fd, create)
+        try:
+            info_fd = _open_directory('info', system_user, directory_fd, create)
+        except Exception:
+            os.close(files_fd)
+            raise
+    finally:
+        os.close(directory_fd)
+
+    return files_fd, info_fd
+
+
+def _check_name(name: str) -> None:
+    if not name or name in ('.', '..') or os.path.basename(name) != name:
+        raise ValueError('Invalid trash item name')
+
+
+def get_trash_directory(path: str, system_user: SystemUser) -> str:
+    """
+    Returns trash directory on the same filesystem as path
+    @param path: trashed path
+    @param system_user: owner of trash
+    @return:
+    """
+    path_device = os.lstat(path).st_dev
+    if os.stat(system_user.home_directory).st_dev == path_device:
+        return _get_home_trash(system_user)
+
+    return os.path.join(_get_mount_point(os.path.dirname(path)), '.Trash-{}'.format(system_user.id))
+
+
+def is_trash_directory(trash_directory: str, system_user: SystemUser) -> bool:
+    """
+    Checks that trash_directory is trash of system_user
+    @param trash_directory:
+    @param system_user:
+    @return:
+    """
+    trash_directory = os.path.normpath(trash_directory)
+    home_trash = _get_home_trash(system_user)
+    if trash_directory != home_trash and os.path.basename(trash_directory) != '.Trash-{}'.format(system_user.id):
+        return False
+
+    try:
+        return os.lstat(trash_directory).st_uid == system_user.id
+    except OSError:
+        return False
+
+
+def move_to_trash(path: str, system_user: SystemUser) -> dict:
+    """
+    Moves path to trash
+    @param path: absolute path of trashed file or directory
+    @param system_user: owner of trash
+    @return: trash item
+    """
+    trash_directory = get_trash_directory(path, system_user)
+    base_name = os.path.basename(path)
+    deleted = datetime.datetime.now().replace(microsecond=0)
+
+    files_fd, info_fd = _open_trash(trash_directory, system_user, create=True)
+    try:
+        # Info file is created exclusively first, it reserves the name in trash
+        counter = 0
+        while True:
+            name = base_name if not counter else '{}.{}'.format(base_name, counter)
+            info_name = '{}.trashinfo'.format(name)
+            try:
+                info_file_fd = os.open(info_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600, dir_fd=info_fd)
+                break
+            except FileExistsError:
+                counter += 1
+
+        with os.fdopen(info_file_fd, 'w') as info_file:
+            os.fchown(info_file.fileno(), system_user.id, system_user.group_id)
+            info_file.write('[Trash Info]\nPath={}\nDeletionDate={}\n'.format(urllib.parse.quote(path), deleted.isoformat()))
+
+        try:
+            os.rename(path, name, dst_dir_fd=files_fd)
+        except OSError:
+            os.unlink(info_name, dir_fd=info_fd)
+            raise
+    finally:
+        os.close(files_fd)
+        os.close(info_fd)
+
+    return {
+        'name': name,
+        'absolute': path,
+        'trash_directory': trash_directory,
+        'deleted': deleted,
+    }
+
+
+def get_trash_item(trash_directory: str, name: str, info_fd: int) -> Union[dict, None]:
+    """
+    Reads info file of trashed item
+    @param trash_directory:
+    @param name: name of item in trash
+    @param info_fd: info directory opened by _open_trash
+    @return: trash item or None when item has no valid info file
+    """
+    try:
+        info_file_fd = os.open('{}.trashinfo'.format(name), os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK, dir_fd=info_fd)
+    except OSError:
+        return None
+
+    with os.fdopen(info_file_fd, 'r') as info_file:
+        if not stat.S_ISREG(os.fstat(info_file_fd).st_mode):
+            return None
+        content = info_file.read()
+
+    parser = configparser.ConfigParser(interpolation=None)
+    try:
+        parser.read_string(content)
+    except configparser.Error:
+        return None
+
+    if not parser.has_section('Trash Info'):
+        return None
+
+    return {
+        'name': name,
+        'absolute': urllib.parse.unquote(parser.get('Trash Info', 'Path')),
+        'trash_directory': trash_directory,
+        'deleted': datetime.datetime.fromisoformat(parser.get('Trash Info', 'DeletionDate')),
+    }
+
+
+def _open_restore_directory(absolute: str, system_user: SystemUser) -> int:
+    """
+    Opens directory trashed item is restored into. Original path comes from info file the user can write,
+    so it is checked like any other path the user writes to, on the opened directory so it can not be swapped meanwhile
+    @param absolute: original path of trashed item
+    @param system_user: owner of trash
+    @return: file descriptor of directory
+    """
+    if not os.path.isabs(absolute) or os.path.normpath(absolute) != absolute:
+        raise PermissionError('Invalid original path {}'.format(absolute))
+
+    if any(part.startswith('.') for part in Path(absolute).parts[1:]):
+        raise PermissionError('You have no permission to restore to {}'.format(absolute))
+
+    directory = os.path.dirname(absolute)
+    directory_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        directory_info = FileInfo(Path(directory), False, os.fstat(directory_fd), system_user.username)
+        if not directory_info.is_allowed_file():
+            raise PermissionError('You have no permission to restore to {}'.format(directory))
+    except Exception:
+        os.close(directory_fd)
+        raise
+
+    return directory_fd
+
+
+def restore_from_trash(trash_directory: str, name: str, system_user: SystemUser) -> dict:
+    """
+    Moves trashed item back to its original location
+    @param trash_directory:
+    @param name: name of item in trash
+    @param system_user: owner of trash, original location must be writable by this user
+    @return: restored trash item
+    """
+    _check_name(name)
+    files_fd, info_fd = _open_trash(trash_directory, system_user)
+    try:
+        trash_item = get_trash_item(trash_directory, name, info_fd)
+        if not trash_item:
+            raise FileNotFoundError('Trash item {} was not found'.format(name))
+
+        directory_fd = _open_restore_directory(trash_item['absolute'], system_user)
+        try:
+            restored_name = os.path.basename(trash_item['absolute'])
+            try:
+                os.lstat(restored_name, dir_fd=directory_fd)
+                raise FileExistsError('{} already exists'.format(trash_item['absolute']))
+            except FileNotFoundError:
+                pass
+
+            os.rename(name, restored_name, src_dir_fd=files_fd, dst_dir_fd=directory_fd)
+        finally:
+            os.close(directory_fd)
+
+        os.unlink('{}.trashinfo'.format(name), dir_fd=info_fd)
+    finally:
+        os.close(files_fd)
+        os.close(info_fd)
+
+    return trash_item
+
+
+def purge_trash_item(trash_directory: str, name: str, system_user: SystemUser, batch_size: int = 100, pause: float = 0.05) -> int:
+    """
+    Deletes trashed item, deleting is throttled so it does not starve other I/O on slow storage.
+    Item is walked by file descriptors without following symlinks, user may swap its parts meanwhile
+    @param trash_directory:
+    @param name: name of item in trash
+    @param system_user: owner of trash
+    @param batch_size: number of unlinks between pauses
+    @param pause: seconds to sleep between batches
+    @return: number of removed entries
+    """
+    _check_name(name)
+    files_fd, info_fd = _open_trash(trash_directory, system_user)
+    try:
+        info_name = '{}.trashinfo'.format(name)
+        try:
+            os.lstat(info_name, dir_fd=info_fd)
+        except FileNotFoundError:
+            # Already restored or purged
+            return 0
+
+        removed = 0
+
+        def throttle():
+            if removed and not removed % batch_size:
+                time.sleep(pause)
+
+        try:
+            item_stat = os.lstat(name, dir_fd=files_fd)
+        except FileNotFoundError:
+            item_stat = None
+
+        if item_stat and stat.S_ISDIR(item_stat.st_mode):
+            # fwalk checks every directory it enters is the one it listed, symlinks are never followed
+            for _, directories, files, root_fd in os.fwalk(name, topdown=False, dir_fd=files_fd):
+                for file_name in files:
+                    os.unlink(file_name, dir_fd=root_fd)
+                    removed += 1
+                    throttle()
+                for directory_name in directories:
+                    # Listed directories include symlinks to directories
+                    if stat.S_ISLNK(os.lstat(directory_name, dir_fd=root_fd).st_mode):
+                        os.unlink(directory_name, dir_fd=root_fd)
+                    else:
+                        os.rmdir(directory_name, dir_fd=root_fd)
+                    removed += 1
+                    throttle()
+            os.rmdir(name, dir_fd=files_fd)
+        elif item_stat:
+            os.unlink(name, dir_fd=files_fd)
+        removed += 1
+
+        os.unlink(info_name, dir_fd=info_fd)
+    finally:
+        os.close(files_fd)
+        os.close(info_fd)
+
+    return removed